@@ -20,7 +20,7 @@
 # - **python-dotenv**: 환경 변수 관리
 # 
 
-# In[1]:
+# In[ ]:
 
 
 # 환경 설정 및 라이브러리 import
@@ -48,7 +48,7 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 # 전역 설정
 ASSISTANT_ID = None
 THREAD_ID = None
-CONVERSATION_HISTORY = []  # 빈 리스트로 명시적 초기화
+CONVERSATION_HISTORY = []  # 1-3에서 토큰 예산 대화 메모리(ConversationMemory)로 교체
 MAX_CONVERSATION_LENGTH = 50
 
 print("✅ 환경 설정 완료")
@@ -57,21 +57,18 @@ print(f"matplotlib 버전: {plt.matplotlib.__version__}")
 print(f"numpy 버전: {np.__version__}")
 
 
-# In[2]:
 
+# In[ ]:
 
-# 1. Assistant 생성 및 설정
-def create_probability_assistant():
-    """
-    확률 튜터 Assistant를 생성하는 함수
-    
-    Returns:
-        str: Assistant ID
-    """
-    try:
-        assistant = client.beta.assistants.create(
-            name="ProbTutor",
-            instructions="""당신은 ProbTutor입니다. 대학교 1학년 수준의 확률 개념을 설명하는 친절한 튜터입니다.
+
+# 1. Assistant 생성 및 설정 (로컬 레지스트리로 재사용)
+import hashlib
+from openai import NotFoundError
+
+ASSISTANT_NAME = "ProbTutor"
+ASSISTANT_MODEL = "gpt-4o"
+ASSISTANT_TOOLS = [{"type": "code_interpreter"}]
+ASSISTANT_INSTRUCTIONS = """당신은 ProbTutor입니다. 대학교 1학년 수준의 확률 개념을 설명하는 친절한 튜터입니다.
 
 핵심 임무:
 1. 확률 개념 설명: 정의, 공식, 구성 요소, 구체적 예시 제공
@@ -90,12 +87,74 @@ def create_probability_assistant():
 - "좋아요, 함께 계산해 봅시다."
 - "이 경우엔 확률 분포를 그림으로 보는 게 도움이 될 거예요."
 - "베이즈 정리는 조건부 확률을 계산하는 중요한 공식입니다."
-""",
-            model="gpt-4o",
-            tools=[{"type": "code_interpreter"}]
+"""
+ASSISTANT_REGISTRY_PATH = ".probtutor_assistants.json"  # 설정 해시 → Assistant ID
+
+def assistant_config_hash(instructions: str = ASSISTANT_INSTRUCTIONS, model: str = ASSISTANT_MODEL,
+                          tools: List[Dict] = ASSISTANT_TOOLS) -> str:
+    """지시문·모델·도구 설정으로 Assistant를 식별하는 해시 생성"""
+    config = json.dumps({"instructions": instructions, "model": model, "tools": tools},
+                        ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(config.encode("utf-8")).hexdigest()[:16]
+
+def load_assistant_registry(path: str = ASSISTANT_REGISTRY_PATH) -> Dict[str, Dict]:
+    """로컬 Assistant 레지스트리 로드 (없거나 손상되면 빈 레지스트리)"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_assistant_registry(registry: Dict[str, Dict], path: str = ASSISTANT_REGISTRY_PATH):
+    """레지스트리를 임시 파일에 쓴 뒤 교체 (중간에 중단돼도 파일이 깨지지 않음)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(registry, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def create_probability_assistant(force_new: bool = False, verify: bool = True,
+                                 registry_path: str = ASSISTANT_REGISTRY_PATH):
+    """
+    확률 튜터 Assistant를 가져오거나 생성하는 함수
+    
+    설정(지시문·모델·도구)이 같은 Assistant가 레지스트리에 있으면 재사용하고,
+    없거나 설정이 바뀌었을 때만 새로 생성합니다.
+    
+    Args:
+        force_new: True면 레지스트리를 무시하고 새로 생성
+        verify: True면 재사용 전에 Assistant가 아직 존재하는지 조회해서 확인
+        registry_path: 레지스트리 파일 경로
+    
+    Returns:
+        str: Assistant ID
+    """
+    global ASSISTANT_ID
+    config_hash = assistant_config_hash()
+    registry = load_assistant_registry(registry_path)
+    
+    try:
+        entry = registry.get(config_hash)
+        if entry and not force_new:
+            try:
+                if verify:
+                    client.beta.assistants.retrieve(entry["assistant_id"])
+                ASSISTANT_ID = entry["assistant_id"]
+                print(f"♻️ 기존 ProbTutor Assistant 재사용: {ASSISTANT_ID}")
+                return ASSISTANT_ID
+            except NotFoundError:
+                print(f"⚠️ 등록된 Assistant를 찾을 수 없어 새로 생성합니다: {entry['assistant_id']}")
+        
+        assistant = client.beta.assistants.create(
+            name=ASSISTANT_NAME,
+            instructions=ASSISTANT_INSTRUCTIONS,
+            model=ASSISTANT_MODEL,
+            tools=ASSISTANT_TOOLS
         )
         
-        global ASSISTANT_ID
+        registry[config_hash] = {"assistant_id": assistant.id, "model": ASSISTANT_MODEL,
+                                 "created_at": int(time.time())}
+        save_assistant_registry(registry, registry_path)
+        
         ASSISTANT_ID = assistant.id
         print(f"✅ ProbTutor Assistant 생성 완료: {ASSISTANT_ID}")
         return assistant.id
@@ -104,8 +163,8 @@ def create_probability_assistant():
         print(f"❌ Assistant 생성 중 오류: {e}")
         return None
 
-# Assistant 생성 테스트
-print("🧪 Assistant 생성 테스트:")
+# Assistant 준비 (설정이 바뀌지 않았다면 기존 Assistant 재사용)
+print("🧪 Assistant 준비:")
 assistant_id = create_probability_assistant()
 if assistant_id:
     print(f"  Assistant ID: {assistant_id}")
@@ -113,7 +172,481 @@ else:
     print("  ❌ Assistant 생성 실패")
 
 
-# In[3]:
+
+# In[ ]:
+
+
+# 1-1. Run 실행 및 완료 대기 (스트리밍 + 적응형 폴링)
+ACTIVE_RUN_STATUSES = ('queued', 'in_progress', 'requires_action', 'cancelling')
+TERMINAL_RUN_EVENTS = (
+    'thread.run.completed', 'thread.run.failed', 'thread.run.cancelled',
+    'thread.run.expired', 'thread.run.incomplete', 'thread.run.requires_action'
+)
+RUN_MAX_WAIT = 60          # Run 최대 대기 시간 (초)
+POLL_INITIAL_DELAY = 0.2   # 폴링 첫 대기 간격 (초)
+POLL_MAX_DELAY = 2.0       # 폴링 최대 대기 간격 (초)
+POLL_BACKOFF = 1.5         # 폴링 간격 증가 배수
+RUN_METRICS = []           # Run별 지연 시간 기록
+
+@dataclass
+class RunResult:
+    """Run 실행 결과와 지연 시간 측정값"""
+    run: Any
+    mode: str                      # 'stream' 또는 'poll'
+    total_latency: float           # Run 시작 ~ 종료 상태까지 걸린 시간 (초)
+    ttft: Optional[float] = None   # 첫 토큰까지 걸린 시간 (초), 폴링 모드에서는 측정 불가
+    timed_out: bool = False
+    messages: Optional[List[Any]] = None  # 스트리밍 중 완료된 메시지 (폴링 모드에서는 None)
+
+    @property
+    def status(self) -> str:
+        return self.run.status
+
+def backoff_delays(initial: float = POLL_INITIAL_DELAY, maximum: float = POLL_MAX_DELAY,
+                   factor: float = POLL_BACKOFF):
+    """지수 백오프 폴링 간격 생성기 (initial → maximum까지 factor배씩 증가)"""
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * factor, maximum)
+
+class RunWaiter:
+    """
+    run_assistant / run_assistant_async가 함께 쓰는 Run 대기 상태
+
+    스트리밍 이벤트 처리, 백오프 폴링 간격과 시간 초과 판단, RunResult 생성을 맡고,
+    API 호출(동기/비동기)과 대기(time.sleep / asyncio.sleep)는 호출하는 쪽에서 합니다.
+    """
+
+    def __init__(self, max_wait: float):
+        self.start = time.perf_counter()
+        self.deadline = self.start + max_wait
+        self.run, self.ttft, self.mode = None, None, 'poll'
+        self.timed_out = False
+        self.stream_messages = []
+        self._delays = backoff_delays()
+
+    def on_event(self, event) -> bool:
+        """스트리밍 이벤트 1개 처리. 종료 이벤트를 받았거나 마감 시간이 지나 스트림을 그만 읽어야 하면 True"""
+        if event.event == 'thread.run.created':
+            self.run = event.data
+        elif event.event == 'thread.message.delta' and self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+        elif event.event == 'thread.message.completed':
+            self.stream_messages.append(event.data)
+        elif event.event in TERMINAL_RUN_EVENTS:
+            self.run = event.data
+            self.mode = 'stream'
+            return True
+        return time.perf_counter() > self.deadline
+
+    def next_poll_delay(self) -> Optional[float]:
+        """다음 조회 전 대기 시간 (Run이 종료 상태면 None, 마감 시간이 지났으면 timed_out을 표시하고 None)"""
+        if self.run.status not in ACTIVE_RUN_STATUSES:
+            return None
+        remaining = self.deadline - time.perf_counter()
+        if remaining <= 0:
+            self.timed_out = True
+            return None
+        return min(next(self._delays), remaining)
+
+    def result(self) -> RunResult:
+        return RunResult(
+            run=self.run,
+            mode=self.mode,
+            total_latency=time.perf_counter() - self.start,
+            ttft=self.ttft,
+            timed_out=self.timed_out,
+            messages=self.stream_messages if self.mode == 'stream' else None
+        )
+
+def run_assistant(thread_id: str, assistant_id: Optional[str] = None,
+                  max_wait: float = RUN_MAX_WAIT, stream: bool = True,
+                  verbose: bool = False) -> RunResult:
+    """
+    Run을 생성하고 종료 상태가 될 때까지 기다리는 공용 함수
+
+    스트리밍 API로 이벤트를 받아 종료 이벤트가 오는 즉시 반환합니다.
+    스트리밍을 사용할 수 없거나 도중에 끊기면 지수 백오프 폴링으로 이어서 대기합니다.
+
+    Args:
+        thread_id: 실행할 스레드 ID
+        assistant_id: 사용할 Assistant ID (기본값: ASSISTANT_ID)
+        max_wait: 최대 대기 시간 (초)
+        stream: 스트리밍 API 사용 여부
+        verbose: 폴링 상태 출력 여부
+
+    Returns:
+        RunResult: 최종 Run 객체와 TTFT/전체 지연 시간
+    """
+    assistant_id = assistant_id or ASSISTANT_ID
+    waiter = RunWaiter(max_wait)
+
+    if stream:
+        try:
+            with client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                timeout=max_wait
+            ) as events:
+                for event in events:
+                    if waiter.on_event(event):
+                        break
+        except Exception as e:
+            print(f"⚠️ 스트리밍 실패, 폴링으로 전환합니다: {type(e).__name__}: {str(e)}")
+
+    # 스트리밍으로 Run이 생성되지 않았다면 일반 생성 후 폴링
+    if waiter.run is None:
+        waiter.run = client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id
+        )
+
+    while (delay := waiter.next_poll_delay()) is not None:
+        time.sleep(delay)
+        waiter.run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=waiter.run.id)
+        if verbose:
+            print(f"⏳ 실행 상태: {waiter.run.status} (대기 시간: {time.perf_counter() - waiter.start:.1f}초)")
+
+    if waiter.timed_out:
+        try:
+            client.beta.threads.runs.cancel(thread_id=thread_id, run_id=waiter.run.id)
+        except Exception:
+            pass
+
+    result = waiter.result()
+    RUN_METRICS.append({
+        "run_id": result.run.id,
+        "status": result.run.status,
+        "mode": result.mode,
+        "ttft": result.ttft,
+        "total_latency": result.total_latency
+    })
+    return result
+
+def format_run_latency(result: RunResult) -> str:
+    """Run 지연 시간을 한 줄로 포맷팅"""
+    ttft = f"{result.ttft:.2f}초" if result.ttft is not None else "N/A"
+    return f"⏱️ 첫 토큰: {ttft} / 전체: {result.total_latency:.2f}초 ({result.mode})"
+
+def show_run_metrics():
+    """지금까지 실행한 Run들의 지연 시간 통계 표시"""
+    if not RUN_METRICS:
+        print("📭 Run 실행 기록이 없습니다.")
+        return
+
+    totals = [m["total_latency"] for m in RUN_METRICS]
+    ttfts = [m["ttft"] for m in RUN_METRICS if m["ttft"] is not None]
+
+    print("\n⏱️ Run 지연 시간 통계:")
+    print("=" * 60)
+    print(f"  • 실행 횟수: {len(RUN_METRICS)}회 "
+          f"(stream {sum(m['mode'] == 'stream' for m in RUN_METRICS)}회)")
+    print(f"  • 전체 지연: 평균 {np.mean(totals):.2f}초 / p95 {np.percentile(totals, 95):.2f}초")
+    if ttfts:
+        print(f"  • 첫 토큰: 평균 {np.mean(ttfts):.2f}초 / p95 {np.percentile(ttfts, 95):.2f}초")
+
+print("✅ Run 대기 유틸리티 구현 완료")
+
+
+# In[ ]:
+
+
+# 1-2. Run 응답 조회 및 이미지 캐시
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import field
+
+IMAGE_CACHE_DIR = "probtutor_images"   # 다운로드한 이미지 저장 위치 (file_id.png)
+IMAGE_DOWNLOAD_WORKERS = 4             # 동시에 다운로드할 이미지 수
+IMAGE_CHUNK_SIZE = 64 * 1024           # 스트리밍 다운로드 청크 크기 (bytes)
+
+@dataclass
+class AssistantResponse:
+    """Run 하나에 대한 Assistant 응답 (텍스트 + 이미지 파일 ID)"""
+    text: str
+    image_file_ids: List[str] = field(default_factory=list)
+    run_id: Optional[str] = None
+    image_paths: List[str] = field(default_factory=list)  # 로컬에서 렌더링한 이미지 경로
+    source: str = "assistant"                              # 'assistant' 또는 'local'
+
+    @property
+    def is_error(self) -> bool:
+        return self.text.startswith("❌")
+
+def parse_run_messages(messages: List[Any], run_id: Optional[str] = None) -> AssistantResponse:
+    """
+    Run이 생성한 메시지들(시간순)을 하나의 응답 객체로 정리
+
+    Code Interpreter는 한 Run에서 여러 메시지를 만들 수 있으므로
+    모든 assistant 메시지의 텍스트를 이어 붙이고 이미지 파일 ID를 모읍니다.
+    """
+    texts, image_file_ids = [], []
+    for message in messages:
+        if message.role != "assistant":
+            continue
+        for content in message.content:
+            if hasattr(content, 'text') and content.text:
+                texts.append(content.text.value)
+            elif hasattr(content, 'image_file') and content.image_file:
+                image_file_ids.append(content.image_file.file_id)
+
+    return AssistantResponse(text="\n\n".join(texts), image_file_ids=image_file_ids, run_id=run_id)
+
+def fetch_run_response(thread_id: str, result: RunResult) -> AssistantResponse:
+    """
+    완료된 Run의 응답을 한 번만 조회
+
+    스트리밍으로 받은 메시지가 있으면 추가 API 호출 없이 사용하고,
+    폴링 모드일 때만 해당 Run의 메시지를 한 번 조회합니다.
+    """
+    messages = result.messages
+    if messages is None:
+        messages = client.beta.threads.messages.list(
+            thread_id=thread_id,
+            run_id=result.run.id,
+            order="asc"
+        ).data
+    return parse_run_messages(messages, run_id=result.run.id)
+
+def download_image(file_id: str) -> str:
+    """
+    이미지를 디스크 캐시로 스트리밍 다운로드하고 파일 경로를 반환
+
+    이미 받은 file_id는 다시 다운로드하지 않습니다.
+    """
+    path = os.path.join(IMAGE_CACHE_DIR, f"{file_id}.png")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=IMAGE_CACHE_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f, client.files.with_streaming_response.content(file_id) as response:
+            for chunk in response.iter_bytes(chunk_size=IMAGE_CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+def download_images(file_ids: List[str]) -> Dict[str, str]:
+    """
+    여러 이미지를 병렬로 다운로드 (캐시에 있는 이미지는 건너뜀)
+
+    Returns:
+        Dict[str, str]: file_id → 로컬 파일 경로 (실패한 이미지는 제외)
+    """
+    unique_ids = list(dict.fromkeys(file_ids))
+    paths = {}
+    if not unique_ids:
+        return paths
+
+    with ThreadPoolExecutor(max_workers=IMAGE_DOWNLOAD_WORKERS) as executor:
+        futures = {file_id: executor.submit(download_image, file_id) for file_id in unique_ids}
+        for file_id, future in futures.items():
+            try:
+                paths[file_id] = future.result()
+            except Exception as e:
+                print(f"❌ 이미지 다운로드 실패 ({file_id}): {type(e).__name__}: {str(e)}")
+    return paths
+
+print("✅ 응답 조회 및 이미지 캐시 구현 완료")
+
+
+# In[ ]:
+
+
+# 1-3. 토큰 예산 대화 메모리 (링 버퍼 + 누적 요약)
+from collections import deque
+
+try:
+    import tiktoken
+    TOKEN_ENCODING = tiktoken.encoding_for_model(ASSISTANT_MODEL)
+except Exception:
+    TOKEN_ENCODING = None  # tiktoken이 없으면 글자 수 기반 추정치 사용
+
+MEMORY_TOKEN_BUDGET = 4000      # 서버 스레드에 쌓인 토큰이 이 값을 넘으면 요약으로 새 스레드 시작
+MEMORY_KEEP_RECENT_TURNS = 2    # 새 스레드에 그대로 옮겨 갈 최근 대화 턴 수
+MESSAGE_OVERHEAD_TOKENS = 4     # 메시지 하나당 역할/구분자 토큰
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_MAX_TOKENS = 300
+MEMORY_METRICS = []             # 턴별 스레드 토큰 / 입력 토큰 / 지연 시간
+
+def count_tokens(text: str) -> int:
+    """텍스트의 토큰 수 계산 (tiktoken이 없으면 ASCII 4글자당 1토큰, 그 외 글자당 1토큰으로 추정)"""
+    if TOKEN_ENCODING is not None:
+        return len(TOKEN_ENCODING.encode(text, disallowed_special=()))
+    n_ascii = sum(1 for ch in text if ch.isascii())
+    return max(1, n_ascii // 4 + (len(text) - n_ascii))
+
+def summarize_extractive(summary: str, messages: List[Dict]) -> str:
+    """
+    API 호출 없이 누적 요약 갱신 (질문/답변의 첫 문장만 남기고, 오래된 줄부터 버려 토큰 상한 유지)
+    """
+    lines = [line for line in summary.splitlines() if line.strip()]
+    for msg in messages:
+        first = msg["content"].strip().split("\n")[0][:120]
+        lines.append(f"- {'질문' if msg['role'] == 'user' else '답변'}: {first}")
+
+    kept, used = [], 0
+    for line in reversed(lines):
+        used += count_tokens(line) + 1
+        if used > SUMMARY_MAX_TOKENS:
+            break
+        kept.append(line)
+    return "\n".join(reversed(kept))
+
+def summarize_with_llm(summary: str, messages: List[Dict]) -> str:
+    """
+    기존 요약 + 새로 밀려난 대화만 보내서 요약을 갱신 (전체 히스토리를 다시 요약하지 않음)
+
+    API 호출에 실패하면 summarize_extractive()로 대체합니다.
+    """
+    transcript = "\n".join(
+        f"{'학습자' if msg['role'] == 'user' else 'ProbTutor'}: {msg['content']}" for msg in messages
+    )
+    try:
+        completion = client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": (
+                    "확률 튜터링 대화의 누적 요약을 관리합니다. 기존 요약에 새 대화 내용을 합쳐 "
+                    f"{SUMMARY_MAX_TOKENS}토큰 이내의 한국어 요약으로 갱신하세요. "
+                    "학습자가 다룬 개념, 계산 결과(수치), 학습자의 수준과 헷갈려 한 부분을 남기세요."
+                )},
+                {"role": "user", "content": f"[기존 요약]\n{summary or '(없음)'}\n\n[새 대화]\n{transcript}"}
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0.2
+        )
+        return completion.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"⚠️ 요약 API 호출 실패, 추출 요약 사용: {e}")
+        return summarize_extractive(summary, messages)
+
+class ConversationMemory:
+    """
+    토큰 예산으로 관리되는 대화 메모리
+
+    최근 메시지는 deque(링 버퍼)에 메시지별 토큰 수와 함께 보관하고, 창에서 밀려난 메시지는
+    누적 요약에 조금씩 합칩니다. 서버 스레드에 쌓인 토큰이 예산을 넘으면
+    start_new_thread_context()가 요약 + 최근 턴만으로 새 스레드의 시작 메시지를 만들어
+    턴마다 처리하는 입력 토큰이 일정하게 유지됩니다.
+    """
+
+    def __init__(self, max_messages: int = MAX_CONVERSATION_LENGTH,
+                 token_budget: int = MEMORY_TOKEN_BUDGET,
+                 keep_recent_turns: int = MEMORY_KEEP_RECENT_TURNS,
+                 summarizer=summarize_with_llm):
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.summarizer = summarizer
+        self.clear()
+
+    def clear(self):
+        """메모리 초기화 (새 대화 시작)"""
+        self.messages: deque = deque()
+        self.window_tokens = 0      # 링 버퍼에 있는 메시지들의 토큰 합
+        self.thread_tokens = 0      # 현재 서버 스레드에 쌓인 토큰 추정치
+        self.summary = ""
+        self.summary_tokens = 0
+        self.rollovers = 0
+        self.summary_calls = 0
+        self._pending: List[Dict] = []  # 창에서 밀려났지만 아직 요약에 합치지 않은 메시지
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def append(self, role: str, content: str, in_thread: bool = True, **extra) -> Dict:
+        """
+        메시지 추가 (창이 가득 차면 가장 오래된 메시지를 요약 대기열로 이동)
+
+        Args:
+            role: "user" 또는 "assistant"
+            content: 메시지 텍스트
+            in_thread: 서버 스레드에도 추가된 메시지인지 여부 (로컬 계산 응답은 False)
+            **extra: image_file_ids, image_paths 등 함께 저장할 값
+        """
+        entry = {"role": role, "content": content,
+                 "tokens": count_tokens(content) + MESSAGE_OVERHEAD_TOKENS, **extra}
+        self.messages.append(entry)
+        self.window_tokens += entry["tokens"]
+        if in_thread:
+            self.thread_tokens += entry["tokens"]
+
+        while len(self.messages) > self.max_messages:
+            self._evict_oldest()
+        return entry
+
+    def _evict_oldest(self):
+        entry = self.messages.popleft()
+        self.window_tokens -= entry["tokens"]
+        self._pending.append(entry)
+
+    def update_summary(self):
+        """요약 대기열의 메시지만 기존 요약에 합침 (증분 요약)"""
+        if not self._pending:
+            return
+        self.summary = self.summarizer(self.summary, self._pending)
+        self.summary_tokens = count_tokens(self.summary) if self.summary else 0
+        self.summary_calls += 1
+        self._pending = []
+
+    def needs_new_thread(self) -> bool:
+        """현재 스레드가 토큰 예산을 넘었는지 확인"""
+        return self.thread_tokens > self.token_budget
+
+    def start_new_thread_context(self) -> List[Dict[str, str]]:
+        """
+        최근 턴을 제외한 메시지를 요약에 합치고, 새 스레드를 시작할 메시지 목록 반환
+
+        Returns:
+            List[Dict]: threads.create(messages=...)에 그대로 넘길 수 있는 메시지 목록
+        """
+        while len(self.messages) > 2 * self.keep_recent_turns:
+            self._evict_oldest()
+        self.update_summary()
+
+        seed = []
+        if self.summary:
+            seed.append({"role": "user", "content": f"[이전 대화 요약]\n{self.summary}"})
+        seed.extend({"role": msg["role"], "content": msg["content"]} for msg in self.messages)
+
+        self.thread_tokens = sum(count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS for msg in seed)
+        self.rollovers += 1
+        return seed
+
+def show_memory_stats():
+    """대화 메모리 상태와 턴별 입력 토큰 추이 표시"""
+    memory = CONVERSATION_HISTORY
+    print("\n🧠 대화 메모리 상태:")
+    print("=" * 60)
+    print(f"  • 최근 메시지: {len(memory)}개 ({memory.window_tokens} 토큰)")
+    print(f"  • 누적 요약: {memory.summary_tokens} 토큰 (갱신 {memory.summary_calls}회)")
+    print(f"  • 현재 스레드: {memory.thread_tokens} / {memory.token_budget} 토큰 (새 스레드 전환 {memory.rollovers}회)")
+    print(f"  • 토큰 계산: {'tiktoken' if TOKEN_ENCODING is not None else '글자 수 추정'}")
+
+    prompt_tokens = [m["prompt_tokens"] for m in MEMORY_METRICS if m["prompt_tokens"] is not None]
+    if prompt_tokens:
+        print(f"  • 턴별 입력 토큰: 처음 {prompt_tokens[0]} → 최근 {prompt_tokens[-1]} (최대 {max(prompt_tokens)})")
+    if MEMORY_METRICS:
+        latencies = [m["latency"] for m in MEMORY_METRICS]
+        print(f"  • 턴별 지연 시간: 평균 {np.mean(latencies):.2f}초 / 최근 {latencies[-1]:.2f}초")
+
+CONVERSATION_HISTORY = ConversationMemory()
+
+print("✅ 토큰 예산 대화 메모리 구현 완료")
+print(f"💡 스레드 토큰 예산: {MEMORY_TOKEN_BUDGET} (초과 시 요약으로 새 스레드 시작)")
+
+
+# In[ ]:
 
 
 # 2. 확률 계산 테스트
@@ -144,24 +677,14 @@ def test_probability_calculation():
             content=test_question
         )
         
-        # Assistant 실행
-        run = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=ASSISTANT_ID
-        )
-        
-        # 실행 완료 대기
-        while run.status in ['queued', 'in_progress', 'requires_action']:
-            time.sleep(1)
-            run = client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run.id
-            )
+        # Assistant 실행 및 완료 대기
+        result = run_assistant(thread_id)
+        run = result.run
+        print(format_run_latency(result))
         
         if run.status == 'completed':
             # 응답 가져오기
-            messages = client.beta.threads.messages.list(thread_id=thread_id)
-            response = messages.data[0].content[0].text.value
+            response = fetch_run_response(thread_id, result).text
             
             print("✅ 확률 계산 테스트 성공")
             print(f"🤖 ProbTutor 응답: {response[:200]}...")
@@ -174,13 +697,11 @@ def test_probability_calculation():
         print(f"❌ 확률 계산 테스트 중 오류: {e}")
         return False
 
-# 테스트 실행
-print("🧪 확률 계산 테스트:")
-test_result = test_probability_calculation()
-print(f"테스트 결과: {'성공' if test_result else '실패'}")
+print("✅ 확률 계산 테스트 함수 구현 완료")
 
 
-# In[4]:
+
+# In[ ]:
 
 
 # 3. 시각화 테스트
@@ -211,33 +732,16 @@ def test_visualization():
             content=test_question
         )
         
-        # Assistant 실행
-        run = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=ASSISTANT_ID
-        )
-        
-        # 실행 완료 대기
-        while run.status in ['queued', 'in_progress', 'requires_action']:
-            time.sleep(1)
-            run = client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run.id
-            )
+        # Assistant 실행 및 완료 대기
+        result = run_assistant(thread_id)
+        run = result.run
+        print(format_run_latency(result))
         
         if run.status == 'completed':
-            # 응답 가져오기
-            messages = client.beta.threads.messages.list(thread_id=thread_id)
-            
-            # 텍스트와 이미지를 구분해서 처리
-            text_response = ""
-            has_image = False
-            
-            for content in messages.data[0].content:
-                if hasattr(content, 'text') and content.text:
-                    text_response = content.text.value
-                elif hasattr(content, 'image_file') and content.image_file:
-                    has_image = True
+            # 응답 가져오기 (텍스트와 이미지 파일 ID)
+            response = fetch_run_response(thread_id, result)
+            text_response = response.text
+            has_image = bool(response.image_file_ids)
             
             print("✅ 시각화 테스트 성공")
             if text_response:
@@ -254,24 +758,25 @@ def test_visualization():
         print(f"❌ 시각화 테스트 중 오류: {e}")
         return False
 
-# 테스트 실행
-print("🧪 시각화 테스트:")
-viz_result = test_visualization()
-print(f"테스트 결과: {'성공' if viz_result else '실패'}")
+print("✅ 시각화 테스트 함수 구현 완료")
+
 
 
 # In[ ]:
 
 
 # 3. 핵심 함수들
-def create_new_thread():
-    """새 대화 스레드 생성"""
+def create_new_thread(seed_messages: Optional[List[Dict[str, str]]] = None):
+    """새 대화 스레드 생성 (seed_messages가 있으면 해당 메시지로 시작)"""
     global THREAD_ID
-    thread = client.beta.threads.create()
+    if seed_messages:
+        thread = client.beta.threads.create(messages=seed_messages)
+    else:
+        thread = client.beta.threads.create()
     THREAD_ID = thread.id
     return thread.id
 
-def send_message_to_assistant(message: str) -> str:
+def send_message_to_assistant(message: str) -> AssistantResponse:
     """
     Assistant에게 메시지를 전송하고 응답을 받는 함수
     
@@ -279,15 +784,17 @@ def send_message_to_assistant(message: str) -> str:
         message: 사용자가 입력한 메시지
         
     Returns:
-        str: Assistant의 응답
+        AssistantResponse: Assistant의 응답 (텍스트 + 이미지 파일 ID)
     """
-    global CONVERSATION_HISTORY
-    
     if not ASSISTANT_ID:
-        return "❌ Assistant가 초기화되지 않았습니다."
+        return AssistantResponse("❌ Assistant가 초기화되지 않았습니다.")
     
     if not THREAD_ID:
         create_new_thread()
+    elif CONVERSATION_HISTORY.needs_new_thread():
+        # 스레드가 토큰 예산을 넘으면 요약 + 최근 턴으로 새 스레드 시작
+        print(f"🧠 스레드 토큰 {CONVERSATION_HISTORY.thread_tokens} > 예산 {CONVERSATION_HISTORY.token_budget}, 요약으로 새 스레드 시작")
+        create_new_thread(CONVERSATION_HISTORY.start_new_thread_context())
     
     try:
         print(f"📤 메시지 전송 중... (Thread: {THREAD_ID})")
@@ -301,151 +808,683 @@ def send_message_to_assistant(message: str) -> str:
         
         print("🔄 Assistant 실행 중...")
         
-        # Assistant 실행
-        run = client.beta.threads.runs.create(
-            thread_id=THREAD_ID,
-            assistant_id=ASSISTANT_ID
-        )
+        # Assistant 실행 및 완료 대기
+        max_wait_time = RUN_MAX_WAIT
+        result = run_assistant(THREAD_ID, max_wait=max_wait_time, verbose=True)
+        run = result.run
         
         print(f"🆔 실행 ID: {run.id}")
         
-        # 실행 완료 대기
-        max_wait_time = 60
-        wait_time = 0
-        
-        while run.status in ['queued', 'in_progress', 'requires_action']:
-            print(f"⏳ 실행 상태: {run.status} (대기 시간: {wait_time}초)")
-            time.sleep(2)
-            wait_time += 2
-            
-            if wait_time > max_wait_time:
-                return f"❌ 실행 시간 초과 (최대 {max_wait_time}초 대기)"
-            
-            run = client.beta.threads.runs.retrieve(
-                thread_id=THREAD_ID,
-                run_id=run.id
-            )
+        if result.timed_out:
+            return AssistantResponse(f"❌ 실행 시간 초과 (최대 {max_wait_time}초 대기)")
         
         print(f"✅ 실행 완료: {run.status}")
+        print(format_run_latency(result))
         
         if run.status == 'completed':
-            # 응답 가져오기
+            # 응답 가져오기 (Run당 한 번만 조회)
             print("📥 응답 가져오는 중...")
-            messages = client.beta.threads.messages.list(thread_id=THREAD_ID)
+            response = fetch_run_response(THREAD_ID, result)
             
-            if not messages.data:
-                return "❌ 응답 메시지를 찾을 수 없습니다."
+            if not response.text:
+                return AssistantResponse("❌ 텍스트 응답을 찾을 수 없습니다.")
             
-            latest_message = messages.data[0]
-            print(f"📨 메시지 역할: {latest_message.role}")
-            print(f"📄 컨텐츠 개수: {len(latest_message.content)}")
+            print(f"📝 응답 길이: {len(response.text)}자")
+            print(f"📊 이미지 개수: {len(response.image_file_ids)}개")
             
-            # 텍스트 응답 찾기
-            response_text = ""
-            for content in latest_message.content:
-                if hasattr(content, 'text') and content.text:
-                    response_text = content.text.value
-                    break
+            # 대화 히스토리에 추가 (메시지별 토큰 수 기록)
+            CONVERSATION_HISTORY.append("user", message)
+            CONVERSATION_HISTORY.append("assistant", response.text, image_file_ids=response.image_file_ids)
             
-            if not response_text:
-                return "❌ 텍스트 응답을 찾을 수 없습니다."
+            usage = getattr(run, "usage", None)
+            MEMORY_METRICS.append({
+                "thread_tokens": CONVERSATION_HISTORY.thread_tokens,
+                "prompt_tokens": usage.prompt_tokens if usage else None,
+                "latency": result.total_latency
+            })
             
-            print(f"📝 응답 길이: {len(response_text)}자")
-            
-            # 대화 히스토리에 추가
-            if CONVERSATION_HISTORY is not None:
-                CONVERSATION_HISTORY.append({"role": "user", "content": message})
-                CONVERSATION_HISTORY.append({"role": "assistant", "content": response_text})
-                
-                if len(CONVERSATION_HISTORY) > MAX_CONVERSATION_LENGTH:
-                    CONVERSATION_HISTORY = CONVERSATION_HISTORY[-MAX_CONVERSATION_LENGTH:]
-            
-            return response_text
+            return response
         else:
-            return f"❌ 실행 실패: {run.status}"
+            return AssistantResponse(f"❌ 실행 실패: {run.status}")
             
     except Exception as e:
         print(f"❌ 상세 오류: {type(e).__name__}: {str(e)}")
-        return f"❌ 메시지 전송 중 오류: {e}"
+        return AssistantResponse(f"❌ 메시지 전송 중 오류: {e}")
 
-def display_assistant_response(response: str):
+def display_assistant_response(response: AssistantResponse):
     """
-    Assistant 응답을 표시하는 함수 (텍스트 + 이미지) - 개선 버전
+    Assistant 응답을 표시하는 함수 (텍스트 + 이미지)
+    
+    이미지는 병렬로 다운로드하고 file_id별 디스크 캐시를 사용하므로
+    같은 응답을 다시 표시해도 재다운로드하지 않습니다.
     
     Args:
-        response: Assistant의 응답 텍스트
+        response: send_message_to_assistant()가 반환한 응답 객체
     """
+    if isinstance(response, str):
+        response = AssistantResponse(response)
+    
     # 1. 텍스트 응답 먼저 표시
-    display(Markdown(f"### 🤖 ProbTutor\n{response}"))
+    display(Markdown(f"### 🤖 ProbTutor\n{response.text}"))
     
-    # 2. 이미지가 있으면 표시
-    if not THREAD_ID:
-        print("⚠️ Thread ID가 설정되지 않았습니다.")
-        return
+    # 2. 이미지가 있으면 표시 (로컬 렌더링 이미지는 다운로드 없이 바로 표시)
+    for path in response.image_paths:
+        display(Image(filename=path))
     
-    try:
-        print("\n🔍 이미지 검색 중...")
-        messages = client.beta.threads.messages.list(thread_id=THREAD_ID)
-        
-        if not messages.data:
-            print("⚠️ 메시지를 찾을 수 없습니다.")
-            return
-        
-        latest_message = messages.data[0]
-        print(f"📨 최신 메시지 역할: {latest_message.role}")
-        print(f"📄 컨텐츠 개수: {len(latest_message.content)}")
-        
-        image_found = False
-        for i, content in enumerate(latest_message.content):
-            print(f"🔍 컨텐츠 {i} 타입: {type(content).__name__}")
-            
-            if hasattr(content, 'image_file') and content.image_file:
-                file_id = content.image_file.file_id
-                print(f"📊 이미지 파일 발견! (File ID: {file_id})")
-                
-                try:
-                    # 이미지 다운로드
-                    print("⬇️ 이미지 다운로드 중...")
-                    image_data = client.files.content(file_id)
-                    image_bytes = image_data.read()
-                    
-                    print(f"📏 이미지 크기: {len(image_bytes)} bytes")
-                    
-                    # 이미지 표시
-                    display(Image(image_bytes))
-                    print("✅ 이미지가 성공적으로 표시되었습니다.")
-                    image_found = True
-                    
-                except Exception as img_error:
-                    print(f"❌ 이미지 다운로드 실패: {type(img_error).__name__}: {str(img_error)}")
-                    import traceback
-                    traceback.print_exc()
-        
-        if not image_found:
+    if not response.image_file_ids:
+        if not response.image_paths:
             print("ℹ️ 이 응답에는 이미지가 없습니다.")
-            
-    except Exception as e:
-        print(f"⚠️ 이미지 처리 오류: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        return
+    
+    print(f"\n⬇️ 이미지 {len(response.image_file_ids)}개 불러오는 중...")
+    image_paths = download_images(response.image_file_ids)
+    
+    for file_id in response.image_file_ids:
+        if file_id in image_paths:
+            display(Image(filename=image_paths[file_id]))
+    print(f"✅ 이미지 {len(image_paths)}개가 표시되었습니다.")
 
-def show_conversation_history():
-    """저장된 대화 히스토리를 표시"""
-    if not CONVERSATION_HISTORY:
+def show_conversation_history(show_images: bool = False):
+    """
+    저장된 대화 히스토리를 표시
+    
+    Args:
+        show_images: True면 응답 이미지도 함께 표시 (캐시된 이미지는 재다운로드하지 않음)
+    """
+    if not CONVERSATION_HISTORY and not CONVERSATION_HISTORY.summary:
         print("📭 대화 기록이 없습니다.")
         return
     
     print("\n📜 대화 히스토리:")
     print("=" * 60)
+    if CONVERSATION_HISTORY.summary:
+        print(f"\n🧠 이전 대화 요약 ({CONVERSATION_HISTORY.summary_tokens} 토큰):")
+        print(CONVERSATION_HISTORY.summary)
+        print("-" * 60)
     for msg in CONVERSATION_HISTORY:
         role = "👤 사용자" if msg["role"] == "user" else "🤖 ProbTutor"
-        print(f"\n{role}:")
+        print(f"\n{role} ({msg['tokens']} 토큰):")
         print(msg["content"][:200] + ("..." if len(msg["content"]) > 200 else ""))
+        if show_images:
+            for path in msg.get("image_paths", []):
+                display(Image(filename=path))
+        if show_images and msg.get("image_file_ids"):
+            image_paths = download_images(msg["image_file_ids"])
+            for file_id in msg["image_file_ids"]:
+                if file_id in image_paths:
+                    display(Image(filename=image_paths[file_id]))
         print("-" * 60)
 
 print("✅ 핵심 함수 구현 완료")
 
 
+
+# In[ ]:
+
+
+# 3-1. 로컬 계산 빠른 경로 (닫힌 형태 확률 문제)
+import operator
+import re
+import threading
+from math import comb
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+LOCAL_SOLVER_ENABLED = True   # False면 모든 질문을 Assistant로 전달
+LOCAL_ALWAYS_PLOT = True      # True면 계산 문제에도 분포 그래프를 함께 생성
+PLOT_KEYWORDS = ("그래프", "그려", "시각화", "그림", "플롯", "보여")
+TIER_METRICS = {"local": [], "assistant": []}   # 계층별 응답 지연 시간 (초)
+
+NUM = r"(-?\d+(?:\.\d+)?)"
+COMPARE_OPS = {"==": operator.eq, "<=": operator.le, "<": operator.lt, ">=": operator.ge, ">": operator.gt}
+
+def _find_number(patterns: List[str], text: str) -> Optional[float]:
+    """여러 패턴 중 처음 매칭되는 숫자를 반환 (% 표기는 비율로 변환)"""
+    for pattern in patterns:
+        m = re.search(pattern, text, re.IGNORECASE)
+        if m:
+            raw = m.group(1).strip()
+            value = float(raw.rstrip("%").strip())
+            return value / 100 if raw.endswith("%") else value
+    return None
+
+def _comparison(text: str) -> str:
+    """질문의 비교 표현을 연산자로 변환 (기본값: 같음)"""
+    if re.search(r"이상|적어도|최소|≥|>=", text):
+        return ">="
+    if re.search(r"이하|많아야|최대|≤|<=", text):
+        return "<="
+    if re.search(r"초과|보다\s*많|보다\s*크|>", text):
+        return ">"
+    if re.search(r"미만|보다\s*적|보다\s*작|<", text):
+        return "<"
+    return "=="
+
+COMPARE_WORDS = r">=|<=|≥|≤|<|>|이상|이하|초과|미만|적어도|최소|많아야|최대|보다\s*(?:많|크|적|작)"
+DISJUNCTION = r"또는|혹은|이거나|\d\s*(?:번|회|건|명|개|대|통)?\s*(?:와|과)\s*-?\d"
+COUNT_UNIT = r"\s*(?:번|회|건|명|개|대|통)?\s*"
+# 여러 확률을 더하거나 빼거나 비교하는 질문 ('~확률의 합', '차이', '~보다 큰가')
+AGGREGATE_WORDS = r"확률(?:들)?의\s*(?:합|차)|합(?:은|을|계)|차이|보다\s*(?:더\s*)?(?:큰가|작은가|큰지|작은지|클까|작을까|높은가|낮은가)"
+# 구하려는 값 ('X=3', '2번', '5명'), 시행 횟수('10번 던져서')는 제외
+TARGET_COUNT = r"X\s*(?:=|==|≥|>=|≤|<=|<|>)\s*\d+|(?<![\d.])\d+\s*(?:번|회|건|명|개|대|통)(?!\s*(?:던|시행|반복|굴|뽑))"
+BINOM_N_PATTERNS = [r"n\s*=\s*(\d+)", r"(\d+)\s*(?:번|회)\s*(?:던|시행|반복|굴|뽑)"]
+BINOM_P_PATTERNS = [r"p\s*=\s*(\d*\.?\d+)", r"(?:성공\s*)?확률(?:이|은|는)?\s*(\d*\.?\d+\s*%?)"]
+LAMBDA_PATTERNS = [r"(?:λ|lambda|람다|평균)\s*(?:=|이|은|는|가)?\s*(\d*\.?\d+)"]
+
+def _is_compound(text: str, allowed: int = 1) -> bool:
+    """비교 표현이 allowed개보다 많거나 '또는/와/과'로 묶인 조건인지 (한쪽 경계/구간 풀이로 답하면 안 되는 질문)"""
+    return len(re.findall(COMPARE_WORDS, text)) > allowed or re.search(DISJUNCTION, text) is not None
+
+def _asks_several(text: str, param_patterns: List[List[str]], allowed: int = 1) -> bool:
+    """
+    확률 하나로 답하면 안 되는 질문인지
+
+    - 매개변수(n, p, λ 등) 하나에 값이 둘 이상 ('평균 2일 때 ... 평균 3일 때')
+    - 구하려는 값이 allowed개보다 많음 ('2번 나올 확률과 3번 나올 확률')
+    - 확률끼리 더하거나 빼거나 비교 ('~의 합은', '차이', '~보다 큰가')
+    """
+    for patterns in param_patterns:
+        values = {m.strip() for pattern in patterns for m in re.findall(pattern, text, re.IGNORECASE)}
+        if len(values) > 1:
+            return True
+        for pattern in patterns:
+            text = re.sub(pattern, " ", text, flags=re.IGNORECASE)
+    return len(re.findall(TARGET_COUNT, text)) > allowed or re.search(AGGREGATE_WORDS, text) is not None
+
+def _interval(text: str) -> Optional[Tuple[float, str, float, str]]:
+    """
+    양쪽 경계가 있는 구간 조건을 (a, 아래쪽 연산자, b, 위쪽 연산자)로 변환
+
+    - 'a < X < b', 'a ≤ Z ≤ b'
+    - 'a 이상 b 이하', 'a번 초과 b번 미만'
+    """
+    m = re.search(NUM + r"\s*(<=|≤|<)\s*[XZ]\s*(<=|≤|<)\s*" + NUM, text)
+    if m:
+        return (float(m.group(1)), ">" if m.group(2) == "<" else ">=",
+                float(m.group(4)), "<" if m.group(3) == "<" else "<=")
+    m = re.search(NUM + COUNT_UNIT + r"(이상|초과)\s*(?:이고|이면서|,|그리고)?\s*" + NUM + COUNT_UNIT + r"(이하|미만)", text)
+    if m:
+        return (float(m.group(1)), ">=" if m.group(2) == "이상" else ">",
+                float(m.group(3)), "<=" if m.group(4) == "이하" else "<")
+    return None
+
+def _integer_range(interval: Tuple[float, str, float, str]) -> Tuple[int, int]:
+    """구간 조건을 만족하는 정수 범위 [lo, hi]"""
+    a, lower_op, b, upper_op = interval
+    lo = int(np.ceil(a)) if lower_op == ">=" else int(np.floor(a)) + 1
+    hi = int(np.floor(b)) if upper_op == "<=" else int(np.ceil(b)) - 1
+    return lo, hi
+
+def _two_tails(text: str) -> Optional[Tuple[float, str, float, str]]:
+    """'Z < a 또는 Z > b' 형태의 양쪽 꼬리 조건을 (a, 아래쪽 꼬리 연산자, b, 위쪽 꼬리 연산자)로 변환"""
+    if not re.search(r"또는|혹은|이거나", text):
+        return None
+    symbols = {"≤": "<=", "≥": ">=", "<=": "<=", ">=": ">=", "<": "<", ">": ">"}
+    words = {"이하": "<=", "미만": "<", "이상": ">=", "초과": ">"}
+    bounds = [(symbols[op], float(x)) for op, x in re.findall(r"[XZ]\s*(?:가|이|는)?\s*(<=|>=|≤|≥|<|>)\s*" + NUM, text)]
+    bounds += [(words[op], float(x)) for x, op in re.findall(NUM + r"\s*(이하|미만|이상|초과)", text)]
+    lower = [(op, x) for op, x in bounds if op in ("<=", "<")]
+    upper = [(op, x) for op, x in bounds if op in (">=", ">")]
+    if len(bounds) != 2 or len(lower) != 1 or len(upper) != 1 or lower[0][1] > upper[0][1]:
+        return None
+    return lower[0][1], lower[0][0], upper[0][1], upper[0][0]
+
+def _discrete_probability(pmf, cdf, k: int, op: str) -> float:
+    """이산분포에서 P(X op k) 계산"""
+    if op == "==":
+        return float(pmf(k))
+    if op == "<=":
+        return float(cdf(k))
+    if op == "<":
+        return float(cdf(k - 1))
+    if op == ">=":
+        return float(1 - cdf(k - 1))
+    return float(1 - cdf(k))
+
+def _highlighted(k: int, op: str, upper: int) -> Tuple[int, ...]:
+    """그래프에서 강조할 값 목록"""
+    return tuple(x for x in range(upper + 1) if COMPARE_OPS[op](x, k))
+
+def _format_probability(p: float) -> str:
+    return f"**{p:.4f}** (약 {p * 100:.2f}%)"
+
+def solve_binomial(q: str):
+    """이항분포: '동전을 3번 던져서 앞면이 2번', 'B(10, 0.3)에서 X=4' 등"""
+    m = re.search(r"B\s*\(\s*(\d+)\s*,\s*(\d*\.?\d+)\s*\)", q)
+    if m:
+        n, p = int(m.group(1)), float(m.group(2))
+    else:
+        if not re.search(r"이항|동전|주사위|n\s*=", q, re.IGNORECASE):
+            return None
+        n = _find_number(BINOM_N_PATTERNS, q)
+        if "동전" in q:
+            p = 0.5
+        elif "주사위" in q:
+            p = 1 / 6
+        else:
+            p = _find_number(BINOM_P_PATTERNS, q)
+        if n is None or p is None:
+            return None
+        n = int(n)
+
+    # 'a번 이상 b번 이하'는 구간으로 계산하고, 그 밖의 복합 조건('또는', 경계 3개 이상, 여러 값/합/비교)은 Assistant로
+    interval = _interval(q)
+    allowed = 2 if interval else 1
+    params = [[r"B\s*\(\s*(\d+\s*,\s*\d*\.?\d+)\s*\)"], BINOM_N_PATTERNS, BINOM_P_PATTERNS]
+    if not 0 < p < 1 or _is_compound(q, allowed) or _asks_several(q, params, allowed):
+        return None
+    lines = [f"이항분포 B(n={n}, p={p:.4g})를 사용해서 계산해드릴게요.", ""]
+    if interval:
+        lo, hi = _integer_range(interval)
+        lo, hi = max(lo, 0), min(hi, n)
+        if lo > hi:
+            return None
+        prob = float(stats.binom.cdf(hi, n, p) - stats.binom.cdf(lo - 1, n, p))
+        lines += [f"P({lo} ≤ X ≤ {hi}) = Σ C({n},x) × {p:.4g}^x × {1 - p:.4g}^({n}-x)  (x = {lo}, ..., {hi}에 대해 합산)",
+                  "", f"따라서 확률은 {_format_probability(prob)}입니다.",
+                  f"참고로 기댓값은 np = {n * p:.4g}, 분산은 np(1-p) = {n * p * (1 - p):.4g}입니다."]
+        return "\n".join(lines), ("binom", n, round(p, 6), tuple(range(lo, hi + 1)))
+
+    k = _find_number([r"X\s*(?:=|==|≥|>=|≤|<=|<|>)\s*(\d+)",
+                      r"(?:(?:앞면|뒷면|성공)\s*(?:이|가|은|는)?|(?<!\d)[1-6]\s*(?:이|가))\s*(\d+)\s*(?:번|회)"], q)
+    if k is None or not 0 <= k <= n:
+        return None
+
+    k, op = int(k), _comparison(q)
+    prob = _discrete_probability(lambda x: stats.binom.pmf(x, n, p), lambda x: stats.binom.cdf(x, n, p), k, op)
+
+    if op == "==":
+        lines.append(f"P(X={k}) = C({n},{k}) × {p:.4g}^{k} × {1 - p:.4g}^{n - k} "
+                     f"= {comb(n, k)} × {p ** k:.6g} × {(1 - p) ** (n - k):.6g}")
+    else:
+        lines.append(f"P(X {op} {k}) = Σ C({n},x) × {p:.4g}^x × {1 - p:.4g}^({n}-x)  (조건을 만족하는 x에 대해 합산)")
+    lines += ["", f"따라서 확률은 {_format_probability(prob)}입니다.",
+              f"참고로 기댓값은 np = {n * p:.4g}, 분산은 np(1-p) = {n * p * (1 - p):.4g}입니다."]
+    return "\n".join(lines), ("binom", n, round(p, 6), _highlighted(k, op, n))
+
+def solve_poisson(q: str):
+    """포아송분포: '평균 3인 포아송분포에서 2번 발생할 확률', 'λ=4일 때 P(X≥2)' 등"""
+    if not re.search(r"포아송|푸아송|poisson|λ|람다", q, re.IGNORECASE):
+        return None
+    lam = _find_number(LAMBDA_PATTERNS, q)
+    k = _find_number([r"X\s*(?:=|==|≥|>=|≤|<=|<|>)\s*(\d+)",
+                      r"(\d+)\s*(?:번|회|건|명|개|대|통)\s*(?:이상|이하|초과|미만)?\s*(?:발생|일어|올|나올|도착|올|받)"], q)
+    interval = _interval(q)
+    allowed = 2 if interval else 1
+    if lam is None or lam <= 0 or _is_compound(q, allowed) or _asks_several(q, [LAMBDA_PATTERNS], allowed):
+        return None
+    lines = [f"포아송분포 Poisson(λ={lam:.4g})를 사용해서 계산해드릴게요.", ""]
+    if interval:
+        lo, hi = _integer_range(interval)
+        lo = max(lo, 0)
+        if lo > hi:
+            return None
+        prob = float(stats.poisson.cdf(hi, lam) - stats.poisson.cdf(lo - 1, lam))
+        upper = max(int(lam + 4 * np.sqrt(lam)) + 1, hi + 2)
+        lines += [f"P({lo} ≤ X ≤ {hi}) = Σ e^(-λ) × λ^x / x!  (x = {lo}, ..., {hi}에 대해 합산)",
+                  "", f"따라서 확률은 {_format_probability(prob)}입니다.",
+                  f"포아송분포는 평균과 분산이 모두 λ = {lam:.4g}입니다."]
+        return "\n".join(lines), ("poisson", lam, tuple(range(lo, hi + 1)), upper)
+    if k is None:
+        return None
+
+    k, op = int(k), _comparison(q)
+    prob = _discrete_probability(lambda x: stats.poisson.pmf(x, lam), lambda x: stats.poisson.cdf(x, lam), k, op)
+    upper = max(int(lam + 4 * np.sqrt(lam)) + 1, k + 2)
+
+    if op == "==":
+        lines.append(f"P(X={k}) = e^(-λ) × λ^{k} / {k}! = e^(-{lam:.4g}) × {lam:.4g}^{k} / {k}!")
+    else:
+        lines.append(f"P(X {op} {k}) = Σ e^(-λ) × λ^x / x!  (조건을 만족하는 x에 대해 합산)")
+    lines += ["", f"따라서 확률은 {_format_probability(prob)}입니다.",
+              f"포아송분포는 평균과 분산이 모두 λ = {lam:.4g}입니다."]
+    return "\n".join(lines), ("poisson", lam, _highlighted(k, op, upper), upper)
+
+def solve_normal(q: str, wants_plot: bool = False):
+    """정규분포: '평균 100, 표준편차 15에서 130 이상일 확률', '표준정규분포 그래프' 등"""
+    if not re.search(r"정규|가우시안|normal|Z\s*[<>≤≥]|P\s*\(\s*Z", q, re.IGNORECASE):
+        return None
+    standard = "표준정규" in q or re.search(r"P\s*\(\s*Z", q) is not None
+    mu = _find_number([r"(?:평균|μ|mu)\s*(?:=|이|은|는|가)?\s*(-?\d*\.?\d+)"], q)
+    sigma = _find_number([r"(?:표준\s*편차|σ|sigma)\s*(?:=|이|은|는|가)?\s*(\d*\.?\d+)"], q)
+    variance = _find_number([r"분산\s*(?:=|이|은|는|가)?\s*(\d*\.?\d+)"], q)
+    if sigma is None and variance is not None:
+        sigma = float(np.sqrt(variance))
+    if mu is None and sigma is None and not standard:
+        return None
+    mu = 0.0 if mu is None else mu
+    sigma = 1.0 if sigma is None else sigma
+    if sigma <= 0:
+        return None
+
+    # 구간: 'a와 b 사이', 'a ~ b', 또는 한쪽 경계 'X가 130 이상' / 'P(Z < 1.96)'
+    between = re.search(NUM + r"\s*(?:와|과|에서|~|부터)\s*" + NUM + r"\s*(?:사이|까지)?", q)
+    bound = re.search(r"(?:[XZ]\s*(?:가|이|는)?\s*(?:[<>≤≥]=?)?\s*)" + NUM, q)
+    name = "Z" if standard and mu == 0 and sigma == 1 else "X"
+    dist = stats.norm(mu, sigma)
+    header = f"정규분포 N(μ={mu:.4g}, σ={sigma:.4g})를 사용해서 계산해드릴게요."
+
+    if between and ("사이" in q or "~" in q or "부터" in q):
+        a, b = sorted((float(between.group(1)), float(between.group(2))))
+        prob = float(dist.cdf(b) - dist.cdf(a))
+        za, zb = (a - mu) / sigma, (b - mu) / sigma
+        text = "\n".join([header, "",
+                          f"P({a:.4g} ≤ {name} ≤ {b:.4g}) = Φ({zb:.4f}) - Φ({za:.4f})",
+                          "", f"따라서 확률은 {_format_probability(prob)}입니다."])
+        return text, ("normal", mu, sigma, (a, b))
+
+    # 양쪽 경계: '-1.96 < Z < 1.96', '85 이상 115 이하'
+    interval = _interval(q)
+    if interval and not _is_compound(q, 2):
+        a, lower_op, b, upper_op = interval
+        if a > b:
+            return None
+        prob = float(dist.cdf(b) - dist.cdf(a))
+        za, zb = (a - mu) / sigma, (b - mu) / sigma
+        text = "\n".join([header, "",
+                          f"표준화: z₁ = ({a:.4g} - {mu:.4g}) / {sigma:.4g} = {za:.4f}, z₂ = ({b:.4g} - {mu:.4g}) / {sigma:.4g} = {zb:.4f}",
+                          f"P({a:.4g} {lower_op.replace('>', '<')} {name} {upper_op} {b:.4g}) = Φ({zb:.4f}) - Φ({za:.4f})",
+                          "", f"따라서 확률은 {_format_probability(prob)}입니다."])
+        return text, ("normal", mu, sigma, (a, b))
+
+    # 양쪽 꼬리: 'Z > 1.96 또는 Z < -1.96'
+    tails = _two_tails(q)
+    if tails:
+        a, lower_op, b, upper_op = tails
+        prob = float(dist.cdf(a) + dist.sf(b))
+        za, zb = (a - mu) / sigma, (b - mu) / sigma
+        text = "\n".join([header, "",
+                          f"P({name} {lower_op} {a:.4g} 또는 {name} {upper_op} {b:.4g}) = Φ({za:.4f}) + (1 - Φ({zb:.4f}))",
+                          "", f"따라서 확률은 {_format_probability(prob)}입니다."])
+        return text, ("normal", mu, sigma, (a, b), True)
+
+    # 그 밖에 경계가 여럿이거나 '또는/와/과'로 묶인 조건은 한쪽 경계로 풀지 않고 Assistant로
+    if _is_compound(q):
+        return None
+
+    if bound and _comparison(q) != "==":
+        x, op = float(bound.group(1)), _comparison(q)
+        z = (x - mu) / sigma
+        if op in ("<=", "<"):
+            prob, interval = float(dist.cdf(x)), (None, x)
+        else:
+            prob, interval = float(dist.sf(x)), (x, None)
+        text = "\n".join([header, "",
+                          f"표준화: z = (x - μ) / σ = ({x:.4g} - {mu:.4g}) / {sigma:.4g} = {z:.4f}",
+                          f"P({name} {op} {x:.4g}) = {'Φ(z)' if op in ('<=', '<') else '1 - Φ(z)'}",
+                          "", f"따라서 확률은 {_format_probability(prob)}입니다."])
+        return text, ("normal", mu, sigma, interval)
+
+    if wants_plot:
+        text = "\n".join([f"정규분포 N(μ={mu:.4g}, σ={sigma:.4g})의 확률 밀도 함수를 그려드릴게요.", "",
+                          "f(x) = 1 / (σ√(2π)) × exp(-(x - μ)² / (2σ²))", "",
+                          f"정규분포는 평균 {mu:.4g}을 중심으로 좌우 대칭인 종 모양이며, "
+                          f"μ±σ 구간에 약 68.27%, μ±2σ 구간에 약 95.45%가 들어갑니다."])
+        return text, ("normal", mu, sigma, (mu - sigma, mu + sigma))
+    return None
+
+def solve_bayes(q: str):
+    """
+    조건부 확률/베이즈 정리 (숫자가 명시된 경우)
+
+    - 'P(A|B) = 0.3, P(B) = 0.4일 때 P(A∩B)' 같은 곱셈 법칙
+    - 'P(A) = 0.01, P(B|A) = 0.99, P(B|Aᶜ) = 0.05일 때 P(A|B)' 같은 베이즈 정리
+    - '유병률 1%, 민감도 99%, 특이도 95%일 때 양성이면 실제 환자일 확률'
+    """
+    given = {}
+    for event, value, percent in re.findall(r"P\s*\(\s*([^)]+?)\s*\)\s*=\s*(\d*\.?\d+)\s*(%?)", q):
+        key = re.sub(r"\s+", "", event).replace("ᶜ", "^c").replace("'", "^c").replace("¬A", "A^c")
+        key = key.replace("∩", "&").replace("and", "&").replace(",", "&")
+        given[key] = float(value) / (100 if percent else 1)
+
+    prior = _find_number([r"(?:유병률|사전\s*확률)\s*(?:이|은|는|가)?\s*(\d*\.?\d+\s*%?)"], q)
+    sensitivity = _find_number([r"민감도\s*(?:가|는|이|은)?\s*(\d*\.?\d+\s*%?)"], q)
+    specificity = _find_number([r"특이도\s*(?:가|는|이|은)?\s*(\d*\.?\d+\s*%?)"], q)
+    false_positive = _find_number([r"(?:위양성률|거짓\s*양성률)\s*(?:이|은|는|가)?\s*(\d*\.?\d+\s*%?)"], q)
+    if prior is not None and sensitivity is not None and (specificity is not None or false_positive is not None):
+        given["A"], given["B|A"] = prior, sensitivity
+        given["B|A^c"] = false_positive if false_positive is not None else 1 - specificity
+        target = "A|B"
+    else:
+        asked = [re.sub(r"\s+", "", t).replace("∩", "&") for t in re.findall(r"P\s*\(\s*([^)]+?)\s*\)(?!\s*=)", q)]
+        target = asked[-1] if asked else None
+    if not given or target is None or any(not 0 <= v <= 1 for v in given.values()):
+        return None
+
+    lines, prob = [], None
+    if target in ("A&B", "B&A"):
+        if "A|B" in given and "B" in given:
+            prob = given["A|B"] * given["B"]
+            lines.append(f"곱셈 법칙: P(A∩B) = P(A|B) × P(B) = {given['A|B']:.4g} × {given['B']:.4g}")
+        elif "B|A" in given and "A" in given:
+            prob = given["B|A"] * given["A"]
+            lines.append(f"곱셈 법칙: P(A∩B) = P(B|A) × P(A) = {given['B|A']:.4g} × {given['A']:.4g}")
+    elif target == "A|B":
+        if "A&B" in given and "B" in given and given["B"] > 0:
+            prob = given["A&B"] / given["B"]
+            lines.append(f"조건부 확률: P(A|B) = P(A∩B) / P(B) = {given['A&B']:.4g} / {given['B']:.4g}")
+        elif "B|A" in given and "A" in given:
+            p_b = given.get("B")
+            if p_b is None and "B|A^c" in given:
+                p_b = given["B|A"] * given["A"] + given["B|A^c"] * (1 - given["A"])
+                lines.append(f"전확률 공식: P(B) = P(B|A)P(A) + P(B|Aᶜ)P(Aᶜ) = "
+                             f"{given['B|A']:.4g}×{given['A']:.4g} + {given['B|A^c']:.4g}×{1 - given['A']:.4g} = {p_b:.6g}")
+            if p_b:
+                prob = given["B|A"] * given["A"] / p_b
+                lines.append(f"베이즈 정리: P(A|B) = P(B|A) × P(A) / P(B) = "
+                             f"{given['B|A']:.4g} × {given['A']:.4g} / {p_b:.6g}")
+    elif target == "B" and {"B|A", "A", "B|A^c"} <= given.keys():
+        prob = given["B|A"] * given["A"] + given["B|A^c"] * (1 - given["A"])
+        lines.append(f"전확률 공식: P(B) = P(B|A)P(A) + P(B|Aᶜ)P(Aᶜ) = "
+                     f"{given['B|A']:.4g}×{given['A']:.4g} + {given['B|A^c']:.4g}×{1 - given['A']:.4g}")
+
+    if prob is None or not 0 <= prob <= 1:
+        return None
+    target_text = target.replace("&", "∩")
+    text = "\n".join(["주어진 확률로 계산해드릴게요.", ""] + lines +
+                     ["", f"따라서 P({target_text}) = {_format_probability(prob)}입니다."])
+    return text, ("bar", (f"P({target_text})", "1 - P"), (round(prob, 6), round(1 - prob, 6)))
+
+def solve_dice_sum(q: str):
+    """주사위 합: '주사위를 2개 던져서 합이 7이 될 확률' 등"""
+    dice = _find_number([r"주사위\s*(?:를|을)?\s*(\d+)\s*(?:개|번)"], q)
+    total = _find_number([r"합이\s*(\d+)"], q)
+    if dice is None or total is None or not 1 <= dice <= 10 or _is_compound(q.split("합이", 1)[1]):
+        return None
+
+    dice, total, op = int(dice), int(total), _comparison(q.split("합이", 1)[1])
+    counts = np.array([1])
+    for _ in range(dice):
+        counts = np.convolve(counts, np.ones(6, dtype=int))
+    sums = np.arange(dice, 6 * dice + 1)
+    mask = COMPARE_OPS[op](sums, total)
+    favorable, outcomes = int(counts[mask].sum()), 6 ** dice
+    prob = favorable / outcomes
+
+    text = "\n".join([f"주사위 {dice}개의 모든 경우의 수는 6^{dice} = {outcomes}가지입니다.", "",
+                      f"합이 {total}{'' if op == '==' else ' (' + op + ')'}인 경우의 수: {favorable}가지",
+                      f"P = {favorable} / {outcomes}", "",
+                      f"따라서 확률은 {_format_probability(prob)}입니다."])
+    return text, ("dice_sum", dice, tuple(int(s) for s in sums[mask]))
+
+class LocalPlotRenderer:
+    """
+    분포 그래프를 로컬에서 그리는 렌더러
+
+    Figure 하나를 재사용하고, 같은 그래프(spec)는 디스크 캐시의 PNG를 바로 반환합니다.
+    """
+
+    def __init__(self, cache_dir: str = IMAGE_CACHE_DIR, figsize=(7, 4), dpi: int = 100):
+        self.cache_dir = cache_dir
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.renders = 0
+        self.cache_hits = 0
+        self._lock = threading.Lock()
+
+    def render(self, spec: Tuple) -> str:
+        key = hashlib.sha1(repr(spec).encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, f"local_{key}.png")
+        if os.path.exists(path):
+            self.cache_hits += 1
+            return path
+
+        with self._lock:
+            self.figure.clear()
+            ax = self.figure.add_subplot(111)
+            getattr(self, f"_draw_{spec[0]}")(ax, *spec[1:])
+            ax.grid(True, alpha=0.3)
+            self.figure.tight_layout()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.figure.savefig(path)
+            self.renders += 1
+        return path
+
+    @staticmethod
+    def _bars(ax, xs, ys, highlight):
+        colors = ["tab:orange" if x in highlight else "tab:blue" for x in xs]
+        ax.bar(xs, ys, color=colors)
+        ax.set_xlabel("x")
+        ax.set_ylabel("P(X = x)")
+
+    def _draw_binom(self, ax, n, p, highlight):
+        xs = np.arange(n + 1)
+        self._bars(ax, xs, stats.binom.pmf(xs, n, p), highlight)
+        ax.set_title(f"Binomial PMF (n={n}, p={p:.4g})")
+
+    def _draw_poisson(self, ax, lam, highlight, upper):
+        xs = np.arange(upper + 1)
+        self._bars(ax, xs, stats.poisson.pmf(xs, lam), highlight)
+        ax.set_title(f"Poisson PMF (lambda={lam:.4g})")
+
+    def _draw_dice_sum(self, ax, dice, highlight):
+        counts = np.array([1])
+        for _ in range(dice):
+            counts = np.convolve(counts, np.ones(6, dtype=int))
+        xs = np.arange(dice, 6 * dice + 1)
+        self._bars(ax, xs, counts / 6 ** dice, highlight)
+        ax.set_title(f"Sum of {dice} dice")
+
+    def _draw_normal(self, ax, mu, sigma, interval, outside=False):
+        xs = np.linspace(mu - 4 * sigma, mu + 4 * sigma, 400)
+        ys = stats.norm.pdf(xs, mu, sigma)
+        ax.plot(xs, ys, color="tab:blue")
+        a = xs[0] if interval[0] is None else interval[0]
+        b = xs[-1] if interval[1] is None else interval[1]
+        region = ((xs <= a) | (xs >= b)) if outside else ((xs >= a) & (xs <= b))
+        ax.fill_between(xs, ys, where=region, color="tab:orange", alpha=0.5)
+        ax.set_title(f"Normal PDF (mu={mu:.4g}, sigma={sigma:.4g})")
+        ax.set_xlabel("x")
+        ax.set_ylabel("f(x)")
+
+    def _draw_bar(self, ax, labels, values):
+        ax.bar(labels, values, color=["tab:orange", "tab:blue"])
+        ax.set_ylim(0, 1)
+        ax.set_ylabel("Probability")
+        for i, v in enumerate(values):
+            ax.text(i, v + 0.02, f"{v:.4f}", ha="center")
+
+LOCAL_RENDERER = LocalPlotRenderer()
+LOCAL_SOLVERS = [solve_bayes, solve_dice_sum, solve_normal, solve_poisson, solve_binomial]
+
+def solve_locally(question: str) -> Optional[AssistantResponse]:
+    """
+    닫힌 형태로 풀 수 있는 확률 문제를 로컬에서 계산
+
+    Returns:
+        AssistantResponse: 로컬 풀이 결과 (매칭되는 유형이 없으면 None)
+    """
+    wants_plot = any(word in question for word in PLOT_KEYWORDS)
+    for solver in LOCAL_SOLVERS:
+        try:
+            solution = solver(question, wants_plot) if solver is solve_normal else solver(question)
+        except (ValueError, ZeroDivisionError, OverflowError):
+            solution = None
+        if solution is None:
+            continue
+
+        text, spec = solution
+        image_paths = [LOCAL_RENDERER.render(spec)] if spec and (wants_plot or LOCAL_ALWAYS_PLOT) else []
+        return AssistantResponse(text=text, image_paths=image_paths, source="local")
+    return None
+
+def answer_question(message: str) -> AssistantResponse:
+    """
+    질문에 답하는 진입점: 로컬 계산을 먼저 시도하고, 풀 수 없을 때만 Assistant 호출
+
+    로컬 풀이는 대화 히스토리에는 남지만 Assistant 스레드에는 추가되지 않습니다.
+    """
+    start = time.perf_counter()
+
+    response = solve_locally(message) if LOCAL_SOLVER_ENABLED else None
+    if response is not None:
+        TIER_METRICS["local"].append(time.perf_counter() - start)
+        CONVERSATION_HISTORY.append("user", message, in_thread=False)
+        CONVERSATION_HISTORY.append("assistant", response.text, in_thread=False,
+                                    image_paths=response.image_paths)
+        print(f"⚡ 로컬 계산으로 응답 ({(time.perf_counter() - start) * 1000:.1f}ms)")
+        return response
+
+    response = send_message_to_assistant(message)
+    TIER_METRICS["assistant"].append(time.perf_counter() - start)
+    return response
+
+def show_tier_metrics():
+    """계층별(로컬/Assistant) 적중률과 지연 시간 통계 표시"""
+    total = sum(len(v) for v in TIER_METRICS.values())
+    if not total:
+        print("📭 응답 기록이 없습니다.")
+        return
+
+    print("\n⚡ 계층별 응답 통계:")
+    print("=" * 60)
+    print(f"  • 로컬 적중률: {len(TIER_METRICS['local']) / total * 100:.1f}% ({len(TIER_METRICS['local'])}/{total})")
+    for tier, latencies in TIER_METRICS.items():
+        if latencies:
+            print(f"  • {tier}: 평균 {np.mean(latencies) * 1000:.1f}ms / "
+                  f"p95 {np.percentile(latencies, 95) * 1000:.1f}ms ({len(latencies)}회)")
+    print(f"  • 로컬 그래프: 렌더링 {LOCAL_RENDERER.renders}회 / 캐시 적중 {LOCAL_RENDERER.cache_hits}회")
+
+def test_local_solver():
+    """
+    로컬 계산 경로의 구간/양쪽 꼬리/복합 조건 처리를 확인하는 함수 (API 호출 없음)
+
+    기대값이 None인 질문은 로컬에서 답하지 않고 Assistant로 넘어가야 합니다.
+
+    Returns:
+        bool: 테스트 성공 여부
+    """
+    cases = [
+        ("표준정규분포에서 -1.96 < Z < 1.96 일 확률", stats.norm.cdf(1.96) - stats.norm.cdf(-1.96)),
+        ("평균 100, 표준편차 15인 정규분포에서 X가 85 이상 115 이하일 확률",
+         stats.norm.cdf(115, 100, 15) - stats.norm.cdf(85, 100, 15)),
+        ("표준정규분포에서 Z > 1.96 또는 Z < -1.96일 확률", 2 * stats.norm.sf(1.96)),
+        ("동전을 10번 던져서 앞면이 2번 이상 4번 이하 나올 확률",
+         stats.binom.cdf(4, 10, 0.5) - stats.binom.cdf(1, 10, 0.5)),
+        ("평균 4인 포아송분포에서 2번 이상 5번 이하 발생할 확률",
+         stats.poisson.cdf(5, 4) - stats.poisson.cdf(1, 4)),
+        ("평균 100, 표준편차 15인 정규분포에서 X가 130 이상일 확률", stats.norm.sf(130, 100, 15)),
+        ("동전을 10번 던져서 앞면이 2번 이하 또는 8번 이상 나올 확률", None),
+        ("평균 4인 포아송분포에서 2번 또는 5번 발생할 확률", None),
+        ("주사위를 2개 던져서 합이 3 이상 5 이하 또는 10 이상일 확률", None),
+        ("동전을 4번 던져서 앞면이 2번 나올 확률과 3번 나올 확률의 합은?", None),
+        ("동전을 4번 던져서 앞면이 2번 나올 확률과 3번 나올 확률을 구하시오", None),
+        ("평균 2인 포아송분포에서 X=3일 확률은 평균 3일 때보다 큰가?", None),
+    ]
+    failures = 0
+    for question, expected in cases:
+        response = solve_locally(question)
+        m = re.search(r"\*\*(\d+\.\d+)\*\*", response.text) if response else None
+        got = float(m.group(1)) if m else None
+        ok = got is None if expected is None else got is not None and abs(got - expected) < 5e-4
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {question} → {got} (기대값: {'Assistant' if expected is None else f'{expected:.4f}'})")
+    return failures == 0
+
+print("✅ 로컬 계산 빠른 경로 구현 완료")
+
+
 # In[ ]:
 
 
@@ -469,8 +1508,7 @@ def chat_with_probtutor():
     print("=" * 60)
     
     # 초기화
-    global CONVERSATION_HISTORY
-    CONVERSATION_HISTORY = []
+    CONVERSATION_HISTORY.clear()
     create_new_thread()
     
     while True:
@@ -500,8 +1538,8 @@ def chat_with_probtutor():
             display(Markdown(f"### 👤 사용자\n{user_input}"))
             print("-" * 60)
             
-            # Assistant에게 메시지 전송 및 응답 받기
-            response = send_message_to_assistant(user_input)
+            # 로컬 계산을 먼저 시도하고, 안 되면 Assistant에게 전송
+            response = answer_question(user_input)
             
             # 응답 표시 (텍스트 + 이미지)
             display_assistant_response(response)
@@ -518,6 +1556,7 @@ print("✅ 대화 인터페이스 구현 완료")
 print("💡 chat_with_probtutor() 함수를 호출하여 대화를 시작하세요!")
 
 
+
 # In[ ]:
 
 
@@ -549,87 +1588,41 @@ def test_image_generation():
             content=test_question
         )
         
-        # Assistant 실행
-        run = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=ASSISTANT_ID
-        )
-        
-        print(f"🆔 실행 ID: {run.id}")
+        # Assistant 실행 및 완료 대기
         print("⏳ 실행 완료 대기 중...")
+        max_wait = RUN_MAX_WAIT
+        result = run_assistant(thread_id, max_wait=max_wait)
+        run = result.run
         
-        # 실행 완료 대기
-        max_wait = 60
-        wait_time = 0
+        print(f"🆔 실행 ID: {run.id}")
         
-        while run.status in ['queued', 'in_progress', 'requires_action']:
-            time.sleep(2)
-            wait_time += 2
-            
-            if wait_time % 10 == 0:
-                print(f"   상태: {run.status} (대기 시간: {wait_time}초)")
-            
-            if wait_time > max_wait:
-                print(f"❌ 실행 시간 초과 (최대 {max_wait}초 대기)")
-                return False
-            
-            run = client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run.id
-            )
+        if result.timed_out:
+            print(f"❌ 실행 시간 초과 (최대 {max_wait}초 대기)")
+            return False
         
         print(f"✅ 실행 완료: {run.status}")
+        print(format_run_latency(result))
         
         if run.status == 'completed':
-            messages = client.beta.threads.messages.list(thread_id=thread_id)
-            
-            if not messages.data:
-                print("❌ 응답 메시지를 찾을 수 없습니다.")
-                return False
+            response = fetch_run_response(thread_id, result)
             
-            latest_message = messages.data[0]
-            print(f"\n📨 메시지 역할: {latest_message.role}")
-            print(f"📄 컨텐츠 개수: {len(latest_message.content)}")
-            
-            # 텍스트 응답 찾기
-            response_text = ""
-            for content in latest_message.content:
-                if hasattr(content, 'text') and content.text:
-                    response_text = content.text.value
-                    break
-            
-            if response_text:
-                print(f"📝 텍스트 응답 길이: {len(response_text)}자")
+            if response.text:
+                print(f"📝 텍스트 응답 길이: {len(response.text)}자")
                 print("-" * 60)
-                display(Markdown(f"### 🤖 ProbTutor\n{response_text}"))
+                display(Markdown(f"### 🤖 ProbTutor\n{response.text}"))
                 print("-" * 60)
             
-            # 이미지 확인 및 표시
+            # 이미지 확인 및 표시 (병렬 다운로드 + 캐시)
             print("\n🖼️ 이미지 확인:")
-            image_found = False
+            print(f"  📊 이미지 파일: {response.image_file_ids}")
+            image_paths = download_images(response.image_file_ids)
             
-            for i, content in enumerate(latest_message.content):
-                print(f"  컨텐츠 {i}: {type(content).__name__}")
-                
-                if hasattr(content, 'image_file') and content.image_file:
-                    file_id = content.image_file.file_id
-                    print(f"  📊 이미지 파일 발견: {file_id}")
-                    
-                    try:
-                        print("  ⬇️ 이미지 다운로드 중...")
-                        image_data = client.files.content(file_id)
-                        image_bytes = image_data.read()
-                        
-                        print(f"  📏 이미지 크기: {len(image_bytes)} bytes")
-                        print("  🖼️ 이미지 표시:")
-                        display(Image(image_bytes))
-                        print("  ✅ 이미지가 성공적으로 표시되었습니다!")
-                        image_found = True
-                        
-                    except Exception as img_error:
-                        print(f"  ❌ 이미지 처리 실패: {type(img_error).__name__}: {str(img_error)}")
-                        import traceback
-                        traceback.print_exc()
+            for file_id, path in image_paths.items():
+                print(f"  📏 {file_id}: {os.path.getsize(path)} bytes")
+                display(Image(filename=path))
+            image_found = bool(image_paths)
+            if image_found:
+                print("  ✅ 이미지가 성공적으로 표시되었습니다!")
             
             if not image_found:
                 print("  ℹ️ 이미지가 생성되지 않았습니다.")
@@ -652,8 +1645,780 @@ def test_image_generation():
         traceback.print_exc()
         return False
 
+def run_smoke_tests(include_image: bool = False) -> Dict[str, bool]:
+    """
+    실제 API로 Assistant 동작을 확인하는 스모크 테스트 (명시적으로 호출할 때만 실행)
+    
+    Args:
+        include_image: True면 이미지 생성 테스트까지 실행
+    
+    Returns:
+        Dict[str, bool]: 테스트 이름 → 성공 여부
+    """
+    tests = {
+        "확률 계산": test_probability_calculation,
+        "시각화": test_visualization,
+    }
+    if include_image:
+        tests["이미지 생성"] = test_image_generation
+    
+    results = {}
+    for name, test in tests.items():
+        print(f"\n🧪 {name} 테스트:")
+        results[name] = test()
+        print(f"테스트 결과: {'성공' if results[name] else '실패'}")
+    return results
+
 print("✅ 이미지 생성 테스트 함수 구현 완료")
 print("💡 test_image_generation() 함수로 이미지 생성을 테스트할 수 있습니다.")
+print("💡 run_smoke_tests() 함수로 실제 API 스모크 테스트를 실행할 수 있습니다.")
+
+# PROBTUTOR_SMOKE_TEST=1 환경 변수를 설정한 경우에만 로딩 시 스모크 테스트 실행
+if os.getenv("PROBTUTOR_SMOKE_TEST") == "1":
+    run_smoke_tests()
+
+
+
+# In[ ]:
+
+
+# 5-1. 멀티 세션 ProbTutor (asyncio 세션 관리자)
+import asyncio
+from collections import OrderedDict, deque
+from dataclasses import field
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+MAX_SESSIONS = 1000          # 메모리에 유지할 최대 세션 수
+MAX_CONCURRENT_RUNS = 64     # 동시에 실행할 최대 Run 수
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+def create_async_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> AsyncOpenAI:
+    """모든 세션이 공유할 커넥션 풀 기반 비동기 OpenAI 클라이언트 생성"""
+    return AsyncOpenAI(
+        api_key=api_key or os.getenv("OPENAI_API_KEY"),
+        base_url=base_url,
+        http_client=DefaultAsyncHttpxClient(limits=HTTP_POOL_LIMITS)
+    )
+
+async def run_assistant_async(aclient: AsyncOpenAI, thread_id: str, assistant_id: str,
+                              max_wait: float = RUN_MAX_WAIT, stream: bool = True) -> RunResult:
+    """
+    run_assistant()의 비동기 버전
+
+    스트리밍 이벤트로 종료 상태를 기다리고, 실패하면 지수 백오프 폴링으로 이어서 대기합니다.
+    이벤트 처리와 폴링 간격/시간 초과 판단은 run_assistant()와 같은 RunWaiter를 씁니다.
+    """
+    waiter = RunWaiter(max_wait)
+
+    if stream:
+        try:
+            async with aclient.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                timeout=max_wait
+            ) as events:
+                async for event in events:
+                    if waiter.on_event(event):
+                        break
+        except Exception as e:
+            print(f"⚠️ 스트리밍 실패, 폴링으로 전환합니다: {type(e).__name__}: {str(e)}")
+
+    if waiter.run is None:
+        waiter.run = await aclient.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id
+        )
+
+    while (delay := waiter.next_poll_delay()) is not None:
+        await asyncio.sleep(delay)
+        waiter.run = await aclient.beta.threads.runs.retrieve(thread_id=thread_id, run_id=waiter.run.id)
+
+    if waiter.timed_out:
+        try:
+            await aclient.beta.threads.runs.cancel(thread_id=thread_id, run_id=waiter.run.id)
+        except Exception:
+            pass
+
+    return waiter.result()
+
+@dataclass
+class TutorSession:
+    """학습자 한 명의 대화 상태 (스레드 ID, 제한된 히스토리, Run 잠금)"""
+    session_id: str
+    history: deque
+    thread_id: Optional[str] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_active: float = field(default_factory=time.monotonic)
+
+class SessionManager:
+    """
+    여러 학습자의 ProbTutor 세션을 동시에 처리하는 관리자
+
+    모든 세션이 하나의 Assistant와 하나의 비동기 클라이언트(커넥션 풀)를 공유하고,
+    세션마다 스레드 ID, 길이가 제한된 히스토리, Run 잠금을 따로 가집니다.
+    같은 세션의 요청은 순서대로, 서로 다른 세션의 요청은 동시에 실행됩니다.
+    """
+
+    def __init__(self, aclient: AsyncOpenAI, assistant_id: str,
+                 max_history: int = MAX_CONVERSATION_LENGTH,
+                 max_sessions: int = MAX_SESSIONS,
+                 max_concurrent_runs: int = MAX_CONCURRENT_RUNS,
+                 max_wait: float = RUN_MAX_WAIT,
+                 stream: bool = True,
+                 local_first: bool = LOCAL_SOLVER_ENABLED):
+        self.aclient = aclient
+        self.assistant_id = assistant_id
+        self.max_history = max_history
+        self.max_sessions = max_sessions
+        self.max_wait = max_wait
+        self.stream = stream
+        self.local_first = local_first
+        self.local_hits = 0
+        self.sessions: "OrderedDict[str, TutorSession]" = OrderedDict()
+        self._run_slots = asyncio.Semaphore(max_concurrent_runs)
+
+    def get_session(self, session_id: str) -> TutorSession:
+        """세션을 가져오거나 새로 생성 (가장 오래 사용하지 않은 세션부터 정리)"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = TutorSession(session_id, history=deque(maxlen=self.max_history))
+            self.sessions[session_id] = session
+            self._evict_idle_sessions(keep=session_id)
+
+        self.sessions.move_to_end(session_id)
+        session.last_active = time.monotonic()
+        return session
+
+    def _evict_idle_sessions(self, keep: str):
+        """
+        세션 수가 max_sessions를 넘으면 오래된 순서로 정리
+
+        Run 실행 중인 세션과 방금 만든 세션(keep)은 건너뜁니다.
+        다른 세션이 모두 실행 중이면 잠시 max_sessions를 넘는 것을 허용합니다.
+        """
+        excess = len(self.sessions) - self.max_sessions
+        for session_id, session in list(self.sessions.items()):
+            if excess <= 0:
+                break
+            if session_id == keep or session.lock.locked():
+                continue
+            del self.sessions[session_id]
+            excess -= 1
+
+    def close_session(self, session_id: str):
+        """세션 상태 삭제"""
+        self.sessions.pop(session_id, None)
+
+    async def ask(self, session_id: str, message: str) -> str:
+        """
+        세션의 스레드에 메시지를 보내고 응답 텍스트를 반환
+
+        Args:
+            session_id: 학습자 세션 ID
+            message: 사용자가 입력한 메시지
+
+        Returns:
+            str: Assistant의 응답 (오류 시 ❌로 시작하는 메시지)
+        """
+        session = self.get_session(session_id)
+
+        async with session.lock:
+            try:
+                # 닫힌 형태 계산 문제는 로컬에서 바로 응답 (Assistant 스레드에는 추가하지 않음)
+                local = await asyncio.to_thread(solve_locally, message) if self.local_first else None
+                if local is not None:
+                    self.local_hits += 1
+                    session.history.append({"role": "user", "content": message})
+                    session.history.append({
+                        "role": "assistant",
+                        "content": local.text,
+                        "image_paths": local.image_paths
+                    })
+                    return local.text
+
+                if session.thread_id is None:
+                    thread = await self.aclient.beta.threads.create()
+                    session.thread_id = thread.id
+
+                await self.aclient.beta.threads.messages.create(
+                    thread_id=session.thread_id,
+                    role="user",
+                    content=message
+                )
+
+                async with self._run_slots:
+                    result = await run_assistant_async(
+                        self.aclient, session.thread_id, self.assistant_id,
+                        max_wait=self.max_wait, stream=self.stream
+                    )
+
+                if result.timed_out:
+                    return f"❌ 실행 시간 초과 (최대 {self.max_wait}초 대기)"
+                if result.status != 'completed':
+                    return f"❌ 실행 실패: {result.status}"
+
+                messages = result.messages
+                if messages is None:
+                    page = await self.aclient.beta.threads.messages.list(
+                        thread_id=session.thread_id,
+                        run_id=result.run.id,
+                        order="asc"
+                    )
+                    messages = page.data
+                response = parse_run_messages(messages, run_id=result.run.id)
+                if not response.text:
+                    return "❌ 텍스트 응답을 찾을 수 없습니다."
+
+                session.history.append({"role": "user", "content": message})
+                session.history.append({
+                    "role": "assistant",
+                    "content": response.text,
+                    "image_file_ids": response.image_file_ids
+                })
+                return response.text
+
+            except Exception as e:
+                return f"❌ 메시지 전송 중 오류: {e}"
+
+    async def aclose(self):
+        """공유 클라이언트의 커넥션 풀 정리"""
+        await self.aclient.close()
+
+print("✅ 멀티 세션 관리자 구현 완료")
+
+
+# In[ ]:
+
+
+# 5-2. 로컬 Fake Assistants 엔드포인트 (부하 테스트용)
+import itertools
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class FakeAssistantsServer:
+    """
+    Assistants API 일부를 흉내 내는 로컬 HTTP 서버
+
+    assistants / threads / messages / runs(스트리밍 포함) / files 엔드포인트만 지원하며,
+    모든 Run은 run_latency초(+ 스레드 입력 토큰당 context_latency초) 뒤에 고정된 답변으로 완료되고,
+    Assistant 생성은 assistant_create_latency초가 걸립니다. 완료된 Run의 usage에는
+    스레드 전체 메시지의 토큰 수(prompt_tokens)가 기록됩니다.
+    image_bytes를 주면 답변마다 이미지 파일이 하나씩 첨부됩니다.
+    OpenAI 클라이언트의 base_url을 server.url로 지정해서 사용합니다.
+    """
+
+    def __init__(self, run_latency: float = 0.5, reply: str = "좋아요, 함께 계산해 봅시다. P(X=2) = 0.375입니다.",
+                 image_bytes: Optional[bytes] = None, assistant_create_latency: float = 0.0,
+                 context_latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.run_latency = run_latency
+        self.assistant_create_latency = assistant_create_latency
+        self.context_latency = context_latency
+        self.reply = reply
+        self.image_bytes = image_bytes
+        self.request_counts = Counter()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._assistants: Dict[str, Dict] = {}
+        self._messages: Dict[str, List[Dict]] = {}
+        self._runs: Dict[str, Dict] = {}
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._server_thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._server_thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._server_thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- 가짜 리소스 생성 ---
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids):06d}"
+
+    def _message(self, thread_id: str, role: str, text: str, run_id: Optional[str] = None) -> Dict:
+        return {
+            "id": self._new_id("msg"), "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": thread_id, "role": role, "run_id": run_id, "status": "completed",
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "attachments": [], "metadata": {}
+        }
+
+    def _finish_run(self, run: Dict) -> Dict:
+        """완료 시각이 지난 Run을 completed로 바꾸고 답변 메시지를 추가"""
+        with self._lock:
+            if run["status"] in ("queued", "in_progress") and time.time() >= run["_done_at"]:
+                message = self._message(run["thread_id"], "assistant", self.reply, run["id"])
+                message["assistant_id"] = run["assistant_id"]
+                if self.image_bytes is not None:
+                    message["content"].append({"type": "image_file",
+                                               "image_file": {"file_id": self._new_id("file")}})
+                self._messages[run["thread_id"]].insert(0, message)
+                run["status"] = "completed"
+                run["completed_at"] = int(time.time())
+                completion_tokens = count_tokens(self.reply)
+                run["usage"] = {"prompt_tokens": run["_prompt_tokens"], "completion_tokens": completion_tokens,
+                                "total_tokens": run["_prompt_tokens"] + completion_tokens}
+                run["_reply"] = message
+            elif run["status"] == "queued":
+                run["status"] = "in_progress"
+        return run
+
+    @staticmethod
+    def _public(run: Dict) -> Dict:
+        return {k: v for k, v in run.items() if not k.startswith("_")}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                # 클라이언트가 스트림을 먼저 닫는 경우는 정상 종료로 처리
+                try:
+                    super().handle()
+                except (ConnectionResetError, BrokenPipeError):
+                    pass
+
+            def _body(self) -> Dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _send_json(self, payload: Dict, status: int = 200):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _not_found(self):
+                self._send_json({"error": {"message": f"Not found: {self.path}", "type": "invalid_request_error"}}, 404)
+
+            def _send_event(self, event: str, data: Any):
+                payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+                chunk = f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.flush()
+
+            def _stream_run(self, run: Dict):
+                """Run 진행 상황을 SSE 이벤트로 전송 (답변은 여러 조각으로 나눠 전송)"""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                self._send_event("thread.run.created", server._public(run))
+                time.sleep(max(0.0, run["_done_at"] - time.time()))
+                server._finish_run(run)
+                reply = run["_reply"]
+                self._send_event("thread.message.created", {**reply, "content": [], "status": "in_progress"})
+                for i in range(0, len(server.reply), 8):
+                    self._send_event("thread.message.delta", {
+                        "id": reply["id"], "object": "thread.message.delta",
+                        "delta": {"content": [{"index": 0, "type": "text", "text": {"value": server.reply[i:i + 8]}}]}
+                    })
+                self._send_event("thread.message.completed", reply)
+                self._send_event("thread.run.completed", server._public(run))
+                self._send_event("done", "[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = self._body()
+
+                if path == "/v1/assistants":
+                    server.request_counts["assistants.create"] += 1
+                    time.sleep(server.assistant_create_latency)
+                    assistant = {"id": server._new_id("asst"), "object": "assistant",
+                                 "created_at": int(time.time()), "metadata": {}, **body}
+                    server._assistants[assistant["id"]] = assistant
+                    return self._send_json(assistant)
+
+                if path == "/v1/threads":
+                    server.request_counts["threads.create"] += 1
+                    thread_id = server._new_id("thread")
+                    seed = [server._message(thread_id, msg.get("role", "user"), str(msg.get("content", "")))
+                            for msg in body.get("messages") or []]
+                    with server._lock:
+                        server._messages[thread_id] = seed[::-1]
+                    return self._send_json({"id": thread_id, "object": "thread",
+                                            "created_at": int(time.time()), "metadata": {}})
+
+                m = re.fullmatch(r"/v1/threads/([^/]+)/(messages|runs)", path)
+                if m and m.group(1) in server._messages:
+                    thread_id, resource = m.groups()
+                    if resource == "messages":
+                        server.request_counts["messages.create"] += 1
+                        message = server._message(thread_id, body.get("role", "user"), str(body.get("content", "")))
+                        with server._lock:
+                            server._messages[thread_id].insert(0, message)
+                        return self._send_json(message)
+
+                    server.request_counts["runs.stream" if body.get("stream") else "runs.create"] += 1
+                    with server._lock:
+                        prompt_tokens = sum(count_tokens(msg["content"][0]["text"]["value"]) + MESSAGE_OVERHEAD_TOKENS
+                                            for msg in server._messages[thread_id])
+                    run = {"id": server._new_id("run"), "object": "thread.run", "created_at": int(time.time()),
+                           "thread_id": thread_id, "assistant_id": body.get("assistant_id"),
+                           "status": "queued", "model": "gpt-4o", "instructions": "", "tools": [],
+                           "metadata": {}, "usage": None, "_prompt_tokens": prompt_tokens,
+                           "_done_at": time.time() + server.run_latency + server.context_latency * prompt_tokens}
+                    with server._lock:
+                        server._runs[run["id"]] = run
+                    if body.get("stream"):
+                        return self._stream_run(run)
+                    return self._send_json(server._public(run))
+
+                m = re.fullmatch(r"/v1/threads/([^/]+)/runs/([^/]+)/cancel", path)
+                if m and m.group(2) in server._runs:
+                    server.request_counts["runs.cancel"] += 1
+                    run = server._runs[m.group(2)]
+                    run["status"] = "cancelled"
+                    return self._send_json(server._public(run))
+
+                return self._not_found()
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                path, query = parsed.path, parse_qs(parsed.query)
+
+                m = re.fullmatch(r"/v1/assistants/([^/]+)", path)
+                if m:
+                    server.request_counts["assistants.retrieve"] += 1
+                    assistant = server._assistants.get(m.group(1))
+                    return self._send_json(assistant) if assistant else self._not_found()
+
+                m = re.fullmatch(r"/v1/files/([^/]+)/content", path)
+                if m and server.image_bytes is not None:
+                    server.request_counts["files.content"] += 1
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/png")
+                    self.send_header("Content-Length", str(len(server.image_bytes)))
+                    self.end_headers()
+                    self.wfile.write(server.image_bytes)
+                    return
+
+                m = re.fullmatch(r"/v1/threads/([^/]+)/runs/([^/]+)", path)
+                if m and m.group(2) in server._runs:
+                    server.request_counts["runs.retrieve"] += 1
+                    run = server._finish_run(server._runs[m.group(2)])
+                    return self._send_json(server._public(run))
+
+                m = re.fullmatch(r"/v1/threads/([^/]+)/messages", path)
+                if m and m.group(1) in server._messages:
+                    server.request_counts["messages.list"] += 1
+                    with server._lock:
+                        data = list(server._messages[m.group(1)])
+                    if "run_id" in query:
+                        data = [msg for msg in data if msg["run_id"] == query["run_id"][0]]
+                    if query.get("order") == ["asc"]:
+                        data.reverse()
+                    data = data[:int(query.get("limit", ["20"])[0])]
+                    return self._send_json({
+                        "object": "list", "data": data, "has_more": False,
+                        "first_id": data[0]["id"] if data else None,
+                        "last_id": data[-1]["id"] if data else None
+                    })
+
+                return self._not_found()
+
+        return Handler
+
+print("✅ Fake Assistants 엔드포인트 구현 완료")
+
+
+# In[ ]:
+
+
+# 5-3. 멀티 세션 부하 테스트
+LOAD_TEST_QUESTIONS = [
+    "베이즈 정리란 무엇인가요?",
+    "동전을 3번 던져서 앞면이 2번 나올 확률을 계산해주세요",
+    "정규분포의 특징은 무엇인가요?",
+    "P(A|B) = 0.3, P(B) = 0.4일 때 P(A∩B)를 구해주세요",
+]
+
+async def _simulate_learner(manager: SessionManager, session_id: str, questions: List[str],
+                            latencies: List[float], errors: List[str]):
+    """한 학습자가 질문을 순서대로 보내는 상황을 시뮬레이션"""
+    for question in questions:
+        start = time.perf_counter()
+        response = await manager.ask(session_id, question)
+        latencies.append(time.perf_counter() - start)
+        if response.startswith("❌"):
+            errors.append(response)
+
+async def run_load_test(n_sessions: int = 100, turns_per_session: int = 3,
+                        run_latency: float = 0.5, stream: bool = True,
+                        local_first: bool = False) -> Dict[str, Any]:
+    """
+    로컬 Fake Assistants 엔드포인트를 대상으로 멀티 세션 부하 테스트 실행
+
+    Args:
+        n_sessions: 동시에 접속하는 학습자(세션) 수
+        turns_per_session: 세션당 질문 수
+        run_latency: Fake 서버에서 Run 하나가 완료되는 데 걸리는 시간 (초)
+        stream: 스트리밍 API 사용 여부 (False면 백오프 폴링)
+        local_first: 로컬 계산 빠른 경로 사용 여부 (기본값은 Assistant 경로만 측정)
+
+    Returns:
+        Dict: 처리량(sessions/sec), 지연 시간 p50/p95, HTTP 호출 수 등
+    """
+    questions = [LOAD_TEST_QUESTIONS[i % len(LOAD_TEST_QUESTIONS)] for i in range(turns_per_session)]
+    latencies, errors = [], []
+
+    with FakeAssistantsServer(run_latency=run_latency) as server:
+        aclient = create_async_client(base_url=server.url, api_key="fake-key")
+        assistant = await aclient.beta.assistants.create(
+            name="ProbTutor", model="gpt-4o", tools=[{"type": "code_interpreter"}]
+        )
+        manager = SessionManager(aclient, assistant.id, stream=stream, local_first=local_first)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _simulate_learner(manager, f"learner-{i}", questions, latencies, errors)
+            for i in range(n_sessions)
+        ))
+        elapsed = time.perf_counter() - start
+
+        await manager.aclose()
+        request_counts = dict(server.request_counts)
+
+    report = {
+        "sessions": n_sessions,
+        "turns": len(latencies),
+        "mode": "stream" if stream else "poll",
+        "elapsed": elapsed,
+        "sessions_per_sec": n_sessions / elapsed,
+        "turns_per_sec": len(latencies) / elapsed,
+        "p50_latency": float(np.percentile(latencies, 50)),
+        "p95_latency": float(np.percentile(latencies, 95)),
+        "local_hits": manager.local_hits,
+        "errors": len(errors),
+        "http_requests": sum(request_counts.values()),
+        "request_counts": request_counts,
+    }
+
+    print(f"\n📊 부하 테스트 결과 ({report['mode']}, Run 지연 {run_latency}초)")
+    print("=" * 60)
+    print(f"  • 세션: {n_sessions}개 x {turns_per_session}턴 → {elapsed:.2f}초")
+    print(f"  • 처리량: {report['sessions_per_sec']:.1f} sessions/sec ({report['turns_per_sec']:.1f} turns/sec)")
+    print(f"  • 턴 지연: p50 {report['p50_latency']:.3f}초 / p95 {report['p95_latency']:.3f}초")
+    if local_first:
+        print(f"  • 로컬 계산 응답: {report['local_hits']}턴")
+    print(f"  • HTTP 요청: {report['http_requests']}회 {request_counts}")
+    print(f"  • 오류: {report['errors']}건")
+    return report
+
+async def test_session_eviction() -> bool:
+    """
+    세션 정리 경계 조건 테스트 (API 호출 없음)
+
+    - 오래된 세션이 Run 실행 중이면 건너뛰고 그다음 유휴 세션을 정리
+    - 다른 세션이 모두 실행 중이면 방금 만든 세션을 지우지 않고 max_sessions를 잠시 넘김
+
+    Returns:
+        bool: 모든 경우가 기대한 세션 목록과 같으면 True
+    """
+    manager = SessionManager(None, "asst", max_sessions=2)
+    a, b = manager.get_session("a"), manager.get_session("b")
+    await a.lock.acquire()
+    cases = []
+
+    manager.get_session("c")
+    cases.append(("실행 중인 a는 남기고 b 정리", list(manager.sessions), ["a", "c"]))
+
+    await manager.sessions["c"].lock.acquire()
+    manager.get_session("d")
+    cases.append(("모두 실행 중이면 d를 추가하고 초과 허용", list(manager.sessions), ["a", "c", "d"]))
+
+    a.lock.release()
+    manager.sessions["c"].lock.release()
+    manager.get_session("e")
+    cases.append(("실행이 끝나면 다시 max_sessions로 정리", list(manager.sessions), ["d", "e"]))
+
+    all_passed = True
+    print("\n🧪 세션 정리 테스트")
+    print("=" * 60)
+    for name, got, expected in cases:
+        passed = got == expected
+        all_passed &= passed
+        print(f"  {'✅' if passed else '❌'} {name}: {got} (기대값 {expected})")
+    return all_passed
+
+print("✅ 부하 테스트 함수 구현 완료")
+print("💡 await run_load_test(n_sessions=100) 으로 부하 테스트를 실행할 수 있습니다.")
+print("💡 await test_session_eviction() 으로 세션 정리 경계 조건을 확인할 수 있습니다.")
+
+
+# In[ ]:
+
+
+# 5-4. 콜드 스타트 측정 (로컬 Fake 엔드포인트)
+import contextlib
+
+def measure_cold_start(run_latency: float = 1.0, create_latency: float = 0.5,
+                       trials: int = 3) -> Dict[str, float]:
+    """
+    ProbTutor 시작 비용을 로컬 Fake Assistants 엔드포인트로 측정
+
+    기존 방식(매번 Assistant 생성 + 로딩 시 테스트 Run 2회)과
+    레지스트리 방식(미스/히트)의 소요 시간을 비교합니다.
+
+    Args:
+        run_latency: Fake 서버에서 Run 하나가 완료되는 데 걸리는 시간 (초)
+        create_latency: Fake 서버에서 Assistant 생성에 걸리는 시간 (초)
+        trials: 시나리오별 반복 횟수 (중앙값 사용)
+
+    Returns:
+        Dict[str, float]: 시나리오 → 소요 시간 중앙값 (초)
+    """
+    global client, ASSISTANT_ID
+    original_client, original_assistant_id = client, ASSISTANT_ID
+    n_run_metrics = len(RUN_METRICS)
+    timings = {}
+
+    def timed(startup) -> float:
+        samples = []
+        for _ in range(trials):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                startup()
+            samples.append(time.perf_counter() - start)
+        return float(np.median(samples))
+
+    fake_server = FakeAssistantsServer(run_latency=run_latency, assistant_create_latency=create_latency)
+    with fake_server as server, tempfile.TemporaryDirectory() as tmp_dir:
+        registry_path = os.path.join(tmp_dir, "assistants.json")
+        client = OpenAI(base_url=server.url, api_key="fake-key")
+        try:
+            def legacy_startup():
+                create_probability_assistant(force_new=True, registry_path=registry_path)
+                test_probability_calculation()
+                test_visualization()
+
+            timings["기존 방식 (생성 + 테스트 Run 2회)"] = timed(legacy_startup)
+            timings["레지스트리 미스 (생성)"] = timed(
+                lambda: create_probability_assistant(force_new=True, registry_path=registry_path))
+            timings["레지스트리 히트 (존재 확인)"] = timed(
+                lambda: create_probability_assistant(registry_path=registry_path))
+            timings["레지스트리 히트 (확인 생략)"] = timed(
+                lambda: create_probability_assistant(verify=False, registry_path=registry_path))
+        finally:
+            client, ASSISTANT_ID = original_client, original_assistant_id
+            del RUN_METRICS[n_run_metrics:]
+
+    print(f"\n🚀 콜드 스타트 측정 결과 (Run {run_latency}초 / 생성 {create_latency}초, {trials}회 중앙값)")
+    print("=" * 60)
+    for name, seconds in timings.items():
+        print(f"  • {name}: {seconds * 1000:.1f}ms")
+    return timings
+
+print("✅ 콜드 스타트 측정 함수 구현 완료")
+print("💡 measure_cold_start() 함수로 시작 비용을 비교할 수 있습니다.")
+
+
+# In[ ]:
+
+
+# 5-5. 장시간 대화 측정 (토큰 예산 메모리 on/off, 로컬 Fake 엔드포인트)
+LONG_SESSION_REPLY = (
+    "이항분포 B(n, p)는 성공 확률이 p인 독립 시행을 n번 반복했을 때 성공 횟수의 분포입니다. "
+    "P(X=k) = C(n,k) p^k (1-p)^(n-k)이고, 기댓값은 np, 분산은 np(1-p)입니다. "
+    "예를 들어 동전을 3번 던져 앞면이 2번 나올 확률은 3 × 0.5^3 = 0.375입니다. "
+    "n이 크고 p가 작으면 포아송분포로, np와 n(1-p)가 충분히 크면 정규분포로 근사할 수 있어요."
+)
+
+def measure_long_session(turns: int = 40, token_budget: int = 1500, run_latency: float = 0.05,
+                         context_latency: float = 0.0002) -> Dict[str, Dict[str, float]]:
+    """
+    긴 대화에서 턴별 입력 토큰과 지연 시간을 메모리 on/off로 비교
+
+    Fake 서버는 스레드 전체 토큰 수를 usage.prompt_tokens로 돌려주고,
+    입력 토큰에 비례해 Run 지연 시간이 늘어나도록(context_latency초/토큰) 설정됩니다.
+    요약은 API 호출 없는 summarize_extractive()를 사용합니다.
+
+    Args:
+        turns: 대화 턴 수
+        token_budget: 메모리 on 시나리오의 스레드 토큰 예산
+        run_latency: Run 기본 지연 시간 (초)
+        context_latency: 입력 토큰 1개당 추가 지연 시간 (초)
+
+    Returns:
+        Dict: 시나리오 → 처음/마지막 10턴의 평균 입력 토큰과 지연 시간
+    """
+    global client, ASSISTANT_ID, THREAD_ID, CONVERSATION_HISTORY
+    saved = (client, ASSISTANT_ID, THREAD_ID, CONVERSATION_HISTORY)
+    n_run_metrics, n_memory_metrics = len(RUN_METRICS), len(MEMORY_METRICS)
+    questions = LOAD_TEST_QUESTIONS + [
+        "조건부 확률과 독립의 차이를 설명해주세요",
+        "이항분포의 기댓값과 분산은 어떻게 구하나요?",
+    ]
+    scenarios = {"메모리 off (단일 스레드)": float("inf"), f"메모리 on (예산 {token_budget} 토큰)": token_budget}
+    results = {}
+
+    fake_server = FakeAssistantsServer(run_latency=run_latency, reply=LONG_SESSION_REPLY,
+                                       context_latency=context_latency)
+    with fake_server as server:
+        client = OpenAI(base_url=server.url, api_key="fake-key")
+        try:
+            ASSISTANT_ID = client.beta.assistants.create(name=ASSISTANT_NAME, model=ASSISTANT_MODEL).id
+            for name, budget in scenarios.items():
+                CONVERSATION_HISTORY = ConversationMemory(token_budget=budget, summarizer=summarize_extractive)
+                THREAD_ID = None
+                start_index = len(MEMORY_METRICS)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for turn in range(turns):
+                        send_message_to_assistant(questions[turn % len(questions)])
+                metrics = MEMORY_METRICS[start_index:]
+
+                window = min(10, len(metrics))
+                results[name] = {
+                    "first_prompt_tokens": float(np.mean([m["prompt_tokens"] for m in metrics[:window]])),
+                    "last_prompt_tokens": float(np.mean([m["prompt_tokens"] for m in metrics[-window:]])),
+                    "first_latency": float(np.mean([m["latency"] for m in metrics[:window]])),
+                    "last_latency": float(np.mean([m["latency"] for m in metrics[-window:]])),
+                    "rollovers": CONVERSATION_HISTORY.rollovers,
+                }
+        finally:
+            client, ASSISTANT_ID, THREAD_ID, CONVERSATION_HISTORY = saved
+            del RUN_METRICS[n_run_metrics:]
+            del MEMORY_METRICS[n_memory_metrics:]
+
+    print(f"\n🧠 장시간 대화 측정 결과 ({turns}턴, 처음 10턴 → 마지막 10턴 평균)")
+    print("=" * 60)
+    for name, r in results.items():
+        print(f"  • {name}")
+        print(f"      입력 토큰: {r['first_prompt_tokens']:.0f} → {r['last_prompt_tokens']:.0f}")
+        print(f"      지연 시간: {r['first_latency'] * 1000:.0f}ms → {r['last_latency'] * 1000:.0f}ms"
+              f" (새 스레드 전환 {r['rollovers']}회)")
+    return results
+
+print("✅ 장시간 대화 측정 함수 구현 완료")
+print("💡 measure_long_session() 함수로 메모리 on/off의 턴별 입력 토큰을 비교할 수 있습니다.")
 
 
 # In[ ]:
@@ -666,7 +2431,7 @@ print("=" * 60)
 
 print("\n📋 주요 기능:")
 print("  • 확률 개념 설명 (베이즈 정리, 조건부 확률 등)")
-print("  • 문제 해결 (Code Interpreter를 통한 정확한 계산)")
+print("  • 문제 해결 (이항/포아송/정규/베이즈 계산은 로컬에서 즉시, 나머지는 Code Interpreter)")
 print("  • 시각화 (matplotlib을 활용한 그래프 생성)")
 print("  • 대화형 학습 (사용자 수준에 맞춘 친절한 튜터)")
 
@@ -675,12 +2440,22 @@ print("  1. chat_with_probtutor() - 대화 시작")
 print("  2. test_probability_calculation() - 확률 계산 테스트")
 print("  3. test_visualization() - 시각화 테스트")
 print("  4. test_image_generation() - 이미지 생성 테스트 (개선 버전)")
-print("  5. show_conversation_history() - 대화 기록 확인")
+print("  5. show_conversation_history(show_images=True) - 대화 기록 확인 (이미지는 캐시에서 표시)")
+print("  6. show_run_metrics() - Run 지연 시간 통계")
+print("  7. await run_load_test() - 멀티 세션 부하 테스트 (로컬 Fake 엔드포인트)")
+print("     await test_session_eviction() - 세션 정리 경계 조건 확인 (실행 중인 세션 / 방금 만든 세션은 정리하지 않음)")
+print("  8. run_smoke_tests() - 실제 API 스모크 테스트 (로딩 시 자동 실행되지 않음)")
+print("  9. measure_cold_start() - 콜드 스타트 측정 (로컬 Fake 엔드포인트)")
+print("  10. answer_question(message) - 로컬 계산 우선 질문 (풀 수 없으면 Assistant 호출)")
+print("  11. show_tier_metrics() - 로컬/Assistant 계층별 적중률 및 지연 시간")
+print("  12. show_memory_stats() - 대화 메모리(토큰 예산, 누적 요약, 스레드 전환) 상태")
+print("  13. measure_long_session() - 장시간 대화의 턴별 입력 토큰 비교 (로컬 Fake 엔드포인트)")
+print("  14. test_local_solver() - 로컬 계산의 구간/양쪽 꼬리/복합 조건 확인 (API 호출 없음)")
 
 print("\n🔧 현재 설정:")
 print(f"  • Assistant ID: {ASSISTANT_ID or '미설정'}")
 print(f"  • Thread ID: {THREAD_ID or '미설정'}")
-print(f"  • 대화 히스토리: {len(CONVERSATION_HISTORY)}개 메시지")
+print(f"  • 대화 히스토리: {len(CONVERSATION_HISTORY)}개 메시지 (스레드 토큰 {CONVERSATION_HISTORY.thread_tokens}/{CONVERSATION_HISTORY.token_budget})")
 
 print("\n🚀 빠른 시작:")
 print("  • 대화 시작: chat_with_probtutor()")
@@ -691,6 +2466,7 @@ print("✅ 모든 준비가 완료되었습니다!")
 print("=" * 60)
 
 
+
 # In[ ]:
 
 
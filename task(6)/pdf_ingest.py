@@ -0,0 +1,198 @@
+"""
+PDF 추출 + 토큰 청크 분할 (task(6).ipynb의 프로세스 풀 워커)
+
+워커 함수가 노트북(__main__)이 아니라 import 가능한 모듈에 있어야 spawn/forkserver 시작 방식
+(macOS/Windows 기본값)에서도 프로세스 풀로 넘길 수 있습니다.
+청크 설정 기본값은 노트북 설정 셀과 같고, 노트북은 extract_pdf_chunks(path, chunk_settings)로 자기 설정을 넘깁니다.
+"""
+import os
+import re
+
+import fitz  # PyMuPDF
+import numpy as np
+
+try:
+    import tiktoken
+    ENC = tiktoken.get_encoding("cl100k_base")
+    USING_TIKTOKEN = True
+except ImportError:
+    ENC = None
+    USING_TIKTOKEN = False
+    print("경고: tiktoken 라이브러리를 찾을 수 없습니다. 글자 수 기반으로 청크를 분할합니다.")
+
+MAX_TOKENS_PER_CHUNK = 750
+CHUNK_OVERLAP_TOKENS = 50
+SENTENCE_SNAP_TOKENS = 100   # 청크 경계를 이 토큰 수 안쪽의 문장 경계로 맞춤 (0이면 끔)
+TOKENIZE_THREADS = 1         # 프로세스당 토큰화 스레드 수
+
+# --- PDF 제목 ---
+
+def get_pdf_title(doc, fallback_filename: str) -> str:
+    """PDF 문서 객체에서 제목을 추출합니다. (메타데이터 > 내용 > 파일명 순)"""
+    # 1순위: 메타데이터에서 제목 추출
+    if doc.metadata and doc.metadata.get('title'):
+        title = doc.metadata['title'].strip()
+        # 일반적인 무의미한 제목 제외
+        if len(title) > 5 and not title.lower().startswith(('untitled', 'microsoft word')):
+            return title
+    
+    # 2순위: 첫 페이지 상단 텍스트로 추정 (Heuristic)
+    if len(doc) > 0:
+        try:
+            # 첫 페이지의 텍스트 블록들을 세로 위치(y1) 기준으로 정렬
+            blocks = doc[0].get_text("blocks")
+            blocks.sort(key=lambda b: b[1])
+            
+            potential_title = ""
+            # 상위 3개 텍스트 블록까지 확인하여 제목 조합
+            for block in blocks[:3]:
+                line_text = block[4].replace('\n', ' ').strip()
+                if len(line_text) > 2: # 너무 짧은 줄은 제외
+                    potential_title += " " + line_text
+                    if len(potential_title) > 200: # 제목이 너무 길어지면 중단
+                        break
+            
+            potential_title = potential_title.strip()
+            if len(potential_title) > 5:
+                return potential_title
+        except Exception:
+            pass # 페이지 분석 중 오류 발생 시 다음 단계로 넘어감
+
+    # 3순위: 위 방법 실패 시, 파일명을 정리하여 사용
+    return os.path.splitext(fallback_filename)[0].replace('_', ' ').replace('-', ' ').strip()
+
+# --- 토큰 청크 분할 ---
+# 문서를 한 번만 토큰화하고, 토큰별 바이트 길이로 만든 오프셋으로 원문 바이트를 잘라 청크를 만듭니다.
+# (겹치는 구간을 ENC.decode로 두 번씩 디코딩하지 않음, 결과는 ENC.decode(tokens[start:end])와 같음)
+SENTENCE_PUNCT = (".", "?", "!")
+
+if USING_TIKTOKEN:
+    def _token_bytes(t: int) -> bytes:
+        try:
+            return ENC.decode_single_token_bytes(t)
+        except KeyError:  # 어휘에서 비어 있는 번호
+            return b""
+
+    _vocab = [_token_bytes(t) for t in range(ENC.n_vocab)]
+    TOKEN_BYTE_LEN = np.array([len(b) for b in _vocab], dtype=np.int64)
+    TOKEN_ENDS_SENTENCE = np.array([b.rstrip().endswith(tuple(p.encode() for p in SENTENCE_PUNCT)) for b in _vocab])
+    TOKEN_STARTS_SPACE = np.array([b[:1].isspace() for b in _vocab])
+    del _vocab
+else:
+    PIECE_RE = re.compile(r"\S+\s*|\s+")
+
+def tokenize_texts(texts: list[str], num_threads: int = TOKENIZE_THREADS) -> list[tuple]:
+    """
+    여러 텍스트를 한 번에 토큰화합니다. (tiktoken encode_batch를 스레드로 병렬 실행)
+
+    Returns:
+        텍스트별 (buf, offsets, weights, edges)
+        - buf: 원문 (tiktoken이면 UTF-8 바이트)
+        - offsets: (n+1,) 토큰 경계의 buf 내 위치
+        - weights: (n,) 토큰 수 (tiktoken은 1, 대체 경로는 단어 조각별 추정치)
+        - edges: (n,) 이 토큰 뒤에서 문장이 끝나는지
+    """
+    parts = []
+    if USING_TIKTOKEN:
+        if num_threads > 1:
+            token_lists = ENC.encode_batch(texts, num_threads=num_threads, disallowed_special=())
+        else:  # 스레드 풀 없이 (작업 제출 오버헤드 절약), 가능하면 리스트 대신 numpy 배열로 바로 받음
+            encode = getattr(ENC, "encode_to_numpy", ENC.encode)
+            token_lists = (encode(text, disallowed_special=()) for text in texts)
+        for text, toks in zip(texts, token_lists):
+            toks = np.asarray(toks, dtype=np.int64)
+            offsets = np.zeros(len(toks) + 1, dtype=np.int64)
+            np.cumsum(TOKEN_BYTE_LEN[toks], out=offsets[1:])
+            edges = TOKEN_ENDS_SENTENCE[toks]
+            edges[:-1] &= TOKEN_STARTS_SPACE[toks[1:]]  # "3.5", "e.g.," 처럼 바로 글자가 이어지면 문장 끝이 아님
+            parts.append((text.encode("utf-8"), offsets, np.ones(len(toks), dtype=np.int64), edges))
+    else:  # tiktoken이 없으면 단어 조각 단위로 나누고, UTF-8 4바이트를 1토큰으로 추정
+        for text in texts:
+            spans = [m.span() for m in PIECE_RE.finditer(text)]
+            offsets = np.array([0] + [e for _, e in spans], dtype=np.int64)
+            weights = np.array([max(1, round(len(text[s:e].encode("utf-8")) / 4)) for s, e in spans], dtype=np.int64)
+            edges = np.array([text[s:e].rstrip().endswith(SENTENCE_PUNCT) for s, e in spans], dtype=bool)
+            parts.append((text, offsets, weights, edges))
+    return parts
+
+def chunk_bounds(cum: np.ndarray, sentence_edges: np.ndarray, max_tokens: int = MAX_TOKENS_PER_CHUNK,
+                 overlap: int = CHUNK_OVERLAP_TOKENS, snap: int = SENTENCE_SNAP_TOKENS) -> list[tuple[int, int]]:
+    """
+    토큰 경계 번호 기준 청크 구간 [(start, end), ...]
+
+    Args:
+        cum: (n+1,) 경계까지의 누적 토큰 수
+        sentence_edges: 문장이 끝나는 경계 번호 (오름차순)
+        snap: 청크 끝/다음 청크 시작을 이 토큰 수 안쪽의 문장 경계로 옮김 (0이면 토큰 위치 그대로)
+    """
+    n = len(cum) - 1
+    bounds, start = [], 0
+    while start < n:
+        end = max(start + 1, int(np.searchsorted(cum, cum[start] + max_tokens, "right")) - 1)
+        if end < n:  # 끝을 앞쪽 가장 가까운 문장 경계로
+            i = np.searchsorted(sentence_edges, end, "right") - 1
+            if i >= 0 and sentence_edges[i] > start and cum[end] - cum[sentence_edges[i]] <= snap:
+                end = int(sentence_edges[i])
+        bounds.append((start, end))
+        if end == n:
+            break
+        nxt = int(np.searchsorted(cum, cum[end] - overlap, "left"))
+        i = np.searchsorted(sentence_edges, nxt, "right") - 1  # 다음 시작도 문장 경계로 (겹침이 조금 늘어남)
+        if i >= 0 and sentence_edges[i] > start and cum[nxt] - cum[sentence_edges[i]] <= snap:
+            nxt = int(sentence_edges[i])
+        start = max(nxt, start + 1)
+    return bounds
+
+def split_documents(docs: list[list[str]], num_threads: int = TOKENIZE_THREADS, with_tokens: bool = False,
+                    max_tokens: int = MAX_TOKENS_PER_CHUNK, overlap: int = CHUNK_OVERLAP_TOKENS,
+                    snap: int = SENTENCE_SNAP_TOKENS) -> list[list]:
+    """
+    여러 문서를 한 번에 토큰화해 청크로 분할합니다.
+
+    Args:
+        docs: 문서별 페이지 텍스트 목록 (공백 하나로 이어 붙여 한 문서로 처리)
+        num_threads: 토큰화 스레드 수
+        with_tokens: True면 청크마다 (문자열, 토큰 수)
+        max_tokens / overlap / snap: chunk_bounds 설정
+
+    Returns:
+        문서별 청크 목록
+    """
+    results = []
+    for buf, offsets, weights, edges in tokenize_texts([" ".join(pages) for pages in docs], num_threads):
+        cum = np.zeros(len(weights) + 1, dtype=np.int64)
+        np.cumsum(weights, out=cum[1:])
+        chunks = []
+        for start, end in chunk_bounds(cum, np.flatnonzero(edges) + 1, max_tokens, overlap, snap):
+            piece = buf[offsets[start]:offsets[end]]
+            piece = piece.decode("utf-8", errors="replace") if isinstance(piece, bytes) else piece
+            chunks.append((piece, int(cum[end] - cum[start])) if with_tokens else piece)
+        results.append(chunks)
+    return results
+
+def split_into_chunks(text: str) -> list[str]:
+    """텍스트를 토큰 기준의 청크로 분할합니다."""
+    return split_documents([[text]], num_threads=1)[0]
+
+
+def extract_pdf_chunks(path: str, chunk_settings: dict = None) -> dict:
+    """
+    (프로세스 풀 작업) PDF 한 개에서 제목/페이지 텍스트를 추출하고 바로 청크로 분할합니다.
+
+    Args:
+        path: PDF 경로
+        chunk_settings: split_documents에 넘길 num_threads / max_tokens / overlap / snap (없으면 모듈 기본값)
+
+    Returns:
+        {"file", "title", "pages", "chunks": [(청크, 토큰 수), ...]}, 실패하면 "error" 포함
+    """
+    fname = os.path.basename(path)
+    try:
+        with fitz.open(path) as doc:
+            title = get_pdf_title(doc, fname)
+            n_pages = len(doc)
+            pages = [page.get_text("text").replace('\n', ' ').strip() for page in doc]
+        chunks = split_documents([pages], with_tokens=True, **(chunk_settings or {}))[0] if any(pages) else []   # 내용이 있는 경우에만
+        return {"file": fname, "title": title, "pages": n_pages, "chunks": chunks}
+    except Exception as e:
+        return {"file": fname, "pages": 0, "chunks": [], "error": str(e)}